@@ -1,12 +1,14 @@
+import asyncio
 import os
 from typing import Literal, Optional
 from loguru import logger # type: ignore
+from utils.embedding_cache import TextEmbeddingCache
 from utils.groq import GroqApi
-from utils.models import Models
-from utils.mongodb import MongodbDatabase
-from utils.pinecone import PineconeDatabase
+from utils.metrics import timed
+from utils.models import CLIP_MODEL_NAME, CLIP_PRETRAINED, Models
+from utils.mongodb import MongodbDatabase, cluster_images_id
+from utils.pinecone import FACE_CLUSTERS_FIELD, PineconeDatabase
 from utils.response import AppResponse, ErrorResponse, ServerErrorResponse, SuccessResponse
-import torch
 from bson import ObjectId
 from datetime import datetime
 from dotenv import load_dotenv # type: ignore
@@ -25,23 +27,35 @@ class AlbumMemoryCreation():
         self.mongodb = mongodb
         self.groq_api = groq_api
         self.step_function = step_function
+        # Vectors from another precision would be close but not equal, so each precision has its own entries
+        self.text_embedding_cache = TextEmbeddingCache(f"{CLIP_MODEL_NAME}-{CLIP_PRETRAINED}-{models.precision}")
 
      async def generate_text_embedding(self, text: str) -> AppResponse:
           try:
-               with torch.no_grad():
-                    text_tokens = self.models.tokenizer([text]).to(self.models.device)
-                    text_features = self.models.open_clip_model.encode_text(text_tokens)
+               cached_embeddings = self.text_embedding_cache.get(text)
 
-                    embeddings = text_features.cpu().numpy().flatten()
+               if cached_embeddings is not None:
+                    return SuccessResponse("Generated text embedding successfully", cached_embeddings)
+
+               # On the inference thread, so the Groq and Mongo calls started alongside it keep making progress
+               embeddings = await self.models.inference.run(self.encode_text, text)
+
+               self.text_embedding_cache.put(text, embeddings)
           
-                    return SuccessResponse("Generated text embedding successfully", embeddings)
+               return SuccessResponse("Generated text embedding successfully", embeddings)
           except Exception as e:
                logger.exception(f"Exception at AlbumMemoryCreation generate_text_embedding", exc_info=True)
                return ServerErrorResponse(f"Exception at AlbumMemoryCreation generate_text_embedding", e)
      
+     def encode_text(self, text: str):
+          text_tokens = self.models.tokenizer([text]).to(self.models.device)
+          text_features = self.models.encode_text(text_tokens)
+
+          return text_features.cpu().numpy().flatten()
+
      async def get_names_from_query(self, known_names, search_prompt, names_dict) -> AppResponse:
           try:
-               names_response = self.groq_api.identify_names_from_prompt(known_names, search_prompt)
+               names_response = await self.groq_api.identify_names_from_prompt(known_names, search_prompt)
                
                print("names_response", names_response.success, names_response.data, names_response.error, known_names, search_prompt)
                if not names_response.success:
@@ -62,24 +76,29 @@ class AlbumMemoryCreation():
                logger.exception(f"Exception at AlbumMemoryCreation get_names_from_query", exc_info=True)
                return ServerErrorResponse(f"Exception at AlbumMemoryCreation get_names_from_query", e)
           
-     async def search_images(self, text_prompt, top_k=5, experience_ids = None, image_ids = None) -> AppResponse:
+     async def search_images(self, text_prompt, top_k=5, experience_ids = None, image_ids = None, face_clusters = None, text_embedding = None) -> AppResponse:
           try:
-               generate_text_embedding_result  = await self.generate_text_embedding(text_prompt)
+               if text_embedding is None:
+                    generate_text_embedding_result  = await self.generate_text_embedding(text_prompt)
 
-               if not generate_text_embedding_result.success:
-                    return generate_text_embedding_result
-               
-               text_embedding = generate_text_embedding_result.data
+                    if not generate_text_embedding_result.success:
+                         return generate_text_embedding_result
+                    
+                    text_embedding = generate_text_embedding_result.data
 
                filter_condition = {}
                
+               if face_clusters:
+                    filter_condition[FACE_CLUSTERS_FIELD] = {"$in": face_clusters}
+
                if image_ids:
                     filter_condition["img_id"] = {"$in": image_ids}
 
                if experience_ids:
                     filter_condition["experience_id"] = {"$in": experience_ids}
 
-               results = self.pinecone.index.query(
+               results = await asyncio.to_thread(
+                    self.pinecone.index.query,
                     vector=text_embedding.tolist(),
                     top_k=top_k,
                     include_metadata=True,
@@ -110,6 +129,7 @@ class AlbumMemoryCreation():
                     }, {
                          '$project': {
                               '_id': 0, 
+                              'pinecone_synced_at': 1,
                               'clusters': {
                                    '$map': {
                                         'input': {
@@ -123,25 +143,22 @@ class AlbumMemoryCreation():
                                    }
                               }
                          }
-                    }, {
-                         '$replaceRoot': {
-                              'newRoot': {
-                                   '$arrayToObject': '$clusters'
-                              }
-                         }
                     }
                     ]).to_list()
                
                names_dict = {}
                names_list = []
+               pinecone_synced = False
 
                if isinstance(response, list) and len(response) >0:
-                    names_dict = response[0]
+                    names_dict = {cluster['k']: cluster['v'] for cluster in response[0].get('clusters') or [] if isinstance(cluster.get('k'), str)}
                     names_list = [name for name in names_dict.keys()]                   
+                    pinecone_synced = bool(response[0].get('pinecone_synced_at'))
 
                return SuccessResponse("Successfully fetched names from mongodb", {
                     "names_dict": names_dict, 
-                    "names_list": names_list
+                    "names_list": names_list,
+                    "pinecone_synced": pinecone_synced
                })
           except Exception as e:
                logger.exception(f"Exception at AlbumMemoryCreation search_cluster_names", exc_info=True)
@@ -185,6 +202,24 @@ class AlbumMemoryCreation():
                return ServerErrorResponse(f"Exception at AlbumMemoryCreation fetch_applicable_experience_ids", e)
 
      async def fetch_applicable_image_ids(self, user_id: str, cluster_keys: list[str]) -> AppResponse:
+          try:
+               documents = await self.mongodb.face_cluster_images_collection.find(
+                    {"_id": {"$in": [cluster_images_id(user_id, cluster_key) for cluster_key in cluster_keys]}},
+                    projection={"_id": 0, "img_ids": 1}
+               ).to_list(None)
+
+               if not documents:
+                    # Users not reclustered since face_cluster_images was introduced have no entries yet
+                    return await self.fetch_applicable_image_ids_from_clusters(user_id, cluster_keys)
+
+               image_ids = list(dict.fromkeys(str(image_id) for document in documents for image_id in document.get("img_ids", [])))
+
+               return SuccessResponse("Successfully fetched image_ids from mongodb", image_ids)
+          except Exception as e:
+               logger.exception(f"Exception at AlbumMemoryCreation fetch_applicable_image_ids", exc_info=True)
+               return ServerErrorResponse(f"Exception at AlbumMemoryCreation fetch_applicable_image_ids", e)
+
+     async def fetch_applicable_image_ids_from_clusters(self, user_id: str, cluster_keys: list[str]) -> AppResponse:
           try:
                response = await self.mongodb.face_cluster_collection.aggregate([
                     {
@@ -223,14 +258,16 @@ class AlbumMemoryCreation():
                     }
                ]).to_list()
 
+               image_ids = []
+
                if isinstance(response, list) and len(response)> 0:
                     image_ids = response[0].get("image_ids")
                     image_ids = [str(image_id) for image_id in image_ids]                  
 
                return SuccessResponse("Successfully fetched image_ids from mongodb", image_ids)
           except Exception as e:
-               logger.exception(f"Exception at AlbumMemoryCreation fetch_applicable_image_ids", exc_info=True)
-               return ServerErrorResponse(f"Exception at AlbumMemoryCreation fetch_applicable_image_ids", e)
+               logger.exception(f"Exception at AlbumMemoryCreation fetch_applicable_image_ids_from_clusters", exc_info=True)
+               return ServerErrorResponse(f"Exception at AlbumMemoryCreation fetch_applicable_image_ids_from_clusters", e)
           
      async def update_status_of_album_in_mongodb(self, album_id: str, images: list[str], status: Literal["created", "failure"], failure_reason: Optional[str] = None) -> AppResponse:
           try:
@@ -246,7 +283,7 @@ class AlbumMemoryCreation():
                     }
                )
                     
-               if  update_one_response.acknowledged and update_one_response.modified_count > 0:
+               if  update_one_response.acknowledged and update_one_response.matched_count > 0:
                     return SuccessResponse("Successfully updated album status", None)
                
                return ServerErrorResponse("Failed to update album status")
@@ -273,7 +310,7 @@ class AlbumMemoryCreation():
 
                print("update_one_response", update_one_response)
                     
-               if  update_one_response.acknowledged and update_one_response.modified_count > 0:
+               if  update_one_response.acknowledged and (update_one_response.matched_count > 0 or update_one_response.upserted_id is not None):
                     return SuccessResponse("Successfully updated memory status", None)
                
                return ServerErrorResponse("Failed to update memory status")
@@ -341,35 +378,26 @@ class AlbumMemoryCreation():
                logger.exception(f"Exception at AlbumMemoryCreation fetch_memory_from_mongodb")
                return ServerErrorResponse(f"Exception at AlbumMemoryCreation fetch_memory_from_mongodb", e)
           
-     async def handle_album_request(self, request: dict)-> AppResponse:
-          try:
-               if not isinstance(request, dict):
-                    logger.exception("request is not a dict at AlbumMemoryCreation handle_request", request)
-                    return ErrorResponse("request is not a dict at  AlbumMemoryCreation handle_request", request)
-            
-               album_id = request.get("album_id")
+     async def search_prompt_images(self, creator_id, prompt: str) -> AppResponse:
+          """Find the people named in the prompt and search their images, starting independent stages together.
 
-               if not album_id:
-                    logger.exception("Not all required fields provided for processing image at AlbumMemoryCreation handle_request", request)
-                    return ErrorResponse("album_id not provided for processing image at AlbumMemoryCreation handle_request", request)
-               
-               fetch_album_from_mongodb = await self.fetch_album_from_mongodb(album_id)
+          The text embedding and the experience-id lookup do not depend on the LLM, so they run while the
+          cluster-name and Groq calls are in flight. The experience ids are discarded when the prompt names someone.
+          """
+          text_embedding_task = asyncio.create_task(timed("text_embedding", self.generate_text_embedding(prompt)))
+          experience_ids_task = asyncio.create_task(timed("experience_ids", self.fetch_applicable_experience_ids(creator_id)))
 
-               if not fetch_album_from_mongodb.success:
-                    return fetch_album_from_mongodb
-               
-               prompt = fetch_album_from_mongodb.data.get("prompt")
-               creator_id = fetch_album_from_mongodb.data.get("creator_id")
-               
-               search_cluster_names_result = await self.search_cluster_names(creator_id)
+          try:
+               search_cluster_names_result = await timed("cluster_names", self.search_cluster_names(creator_id))
 
                if not search_cluster_names_result.success:
                     return search_cluster_names_result
                
                names_dict = search_cluster_names_result.data.get("names_dict")
-               names_list = search_cluster_names_result.data.get("names_list")
+               names_dict = {key: value for key, value in names_dict.items() if key.strip()}
+               names_list = list(names_dict.keys())
 
-               get_names_from_query_result = await self.get_names_from_query(names_list, prompt, names_dict)
+               get_names_from_query_result = await timed("names_from_query", self.get_names_from_query(names_list, prompt, names_dict))
 
                if not get_names_from_query_result.success:
                     return get_names_from_query_result
@@ -378,33 +406,74 @@ class AlbumMemoryCreation():
 
                experience_ids = None
                image_ids=None
+               face_clusters = None
 
-               if isinstance(cluster_keys, list) and len(cluster_keys)> 0:
-                    fetch_applicable_image_ids_result = await self.fetch_applicable_image_ids(creator_id, cluster_keys)
+               if isinstance(cluster_keys, list) and len(cluster_keys)> 0 and search_cluster_names_result.data.get("pinecone_synced"):
+                    face_clusters = [cluster_images_id(creator_id, cluster_key) for cluster_key in cluster_keys]
+               elif isinstance(cluster_keys, list) and len(cluster_keys)> 0:
+                    fetch_applicable_image_ids_result = await timed("image_ids", self.fetch_applicable_image_ids(creator_id, cluster_keys))
 
                     if not fetch_applicable_image_ids_result.success:
                          return fetch_applicable_image_ids_result
 
                     image_ids = fetch_applicable_image_ids_result.data
                else:
-                    fetch_applicable_experience_ids_result = await self.fetch_applicable_experience_ids(creator_id)
+                    fetch_applicable_experience_ids_result = await experience_ids_task
 
                     if not fetch_applicable_experience_ids_result.success:
                          return fetch_applicable_experience_ids_result
                     
                     experience_ids = fetch_applicable_experience_ids_result.data
 
-               search_images_result = await self.search_images(prompt, experience_ids=experience_ids, image_ids=image_ids)
+               generate_text_embedding_result = await text_embedding_task
+
+               if not generate_text_embedding_result.success:
+                    return generate_text_embedding_result
+
+               return await timed("pinecone_search", self.search_images(
+                    prompt,
+                    experience_ids=experience_ids,
+                    image_ids=image_ids,
+                    face_clusters=face_clusters,
+                    text_embedding=generate_text_embedding_result.data
+               ))
+          finally:
+               # Speculative stages the result no longer needs
+               for task in (text_embedding_task, experience_ids_task):
+                    if not task.done():
+                         task.cancel()
+
+     async def handle_album_request(self, request: dict)-> AppResponse:
+          try:
+               if not isinstance(request, dict):
+                    logger.exception("request is not a dict at AlbumMemoryCreation handle_request", request)
+                    return ErrorResponse("request is not a dict at  AlbumMemoryCreation handle_request", request)
+            
+               album_id = request.get("album_id")
+
+               if not album_id:
+                    logger.exception("Not all required fields provided for processing image at AlbumMemoryCreation handle_request", request)
+                    return ErrorResponse("album_id not provided for processing image at AlbumMemoryCreation handle_request", request)
+               
+               fetch_album_from_mongodb = await timed("fetch_album", self.fetch_album_from_mongodb(album_id))
+
+               if not fetch_album_from_mongodb.success:
+                    return fetch_album_from_mongodb
+               
+               prompt = fetch_album_from_mongodb.data.get("prompt")
+               creator_id = fetch_album_from_mongodb.data.get("creator_id")
+               
+               search_images_result = await self.search_prompt_images(creator_id, prompt)
 
                if not search_images_result.success:
                     return search_images_result
                
-               update_status_of_album_in_mongodb_result = await self.update_status_of_album_in_mongodb(
+               update_status_of_album_in_mongodb_result = await timed("update_status", self.update_status_of_album_in_mongodb(
                     album_id=album_id, 
                     images=search_images_result.data if search_images_result.data else [],
                     status="created" if search_images_result.data else "failure",
                     failure_reason=search_images_result.message
-               )
+               ))
 
                if not update_status_of_album_in_mongodb_result.success:
                     return update_status_of_album_in_mongodb_result
@@ -427,7 +496,7 @@ class AlbumMemoryCreation():
                     logger.exception("Not all required fields provided for processing image at AlbumMemoryCreation handle_request", request)
                     return ErrorResponse("memory_id not provided for processing image at AlbumMemoryCreation handle_request", request)
                
-               fetch_memory_from_mongodb_result = await self.fetch_memory_from_mongodb(memory_id)
+               fetch_memory_from_mongodb_result = await timed("fetch_memory", self.fetch_memory_from_mongodb(memory_id))
 
                if not fetch_memory_from_mongodb_result.success:
                     return fetch_memory_from_mongodb_result
@@ -435,69 +504,35 @@ class AlbumMemoryCreation():
                prompt = fetch_memory_from_mongodb_result.data.get("prompt")
                creator_id = fetch_memory_from_mongodb_result.data.get("creator_id")
                
-               search_cluster_names_result = await self.search_cluster_names(creator_id)
-
-               if not search_cluster_names_result.success:
-                    return search_cluster_names_result
-               
-               names_dict = search_cluster_names_result.data.get("names_dict")
-               names_dict = {key: value for key, value in names_dict.items() if key.strip()}
-               names_list = search_cluster_names_result.data.get("names_list")
-
-               get_names_from_query_result = await self.get_names_from_query(names_list, prompt, names_dict)
-
-               if not get_names_from_query_result.success:
-                    return get_names_from_query_result
-
-               cluster_keys = get_names_from_query_result.data.get("cluster_keys")
-
-               experience_ids = None
-               image_ids=None
-
-               if isinstance(cluster_keys, list) and len(cluster_keys)> 0:
-                    fetch_applicable_image_ids_result = await self.fetch_applicable_image_ids(creator_id, cluster_keys)
-
-                    if not fetch_applicable_image_ids_result.success:
-                         return fetch_applicable_image_ids_result
-
-                    image_ids = fetch_applicable_image_ids_result.data
-               else:
-                    fetch_applicable_experience_ids_result = await self.fetch_applicable_experience_ids(creator_id)
-
-                    if not fetch_applicable_experience_ids_result.success:
-                         return fetch_applicable_experience_ids_result
-                    
-                    experience_ids = fetch_applicable_experience_ids_result.data
-
-               search_images_result = await self.search_images(prompt, experience_ids=experience_ids, image_ids=image_ids)
+               search_images_result = await self.search_prompt_images(creator_id, prompt)
 
                if not search_images_result.success:
                     return search_images_result
                
                if not search_images_result.data:
-                    update_status_of_memory_in_mongodb_result = await self.update_status_of_memory_in_mongodb(
+                    update_status_of_memory_in_mongodb_result = await timed("update_status", self.update_status_of_memory_in_mongodb(
                          memory_id=memory_id,
                          status="failure",
                          failure_reason=search_images_result.message
-                    )
+                    ))
 
                     if not update_status_of_memory_in_mongodb_result.success:
                          return update_status_of_memory_in_mongodb_result
 
-               trigger_step_function_execution_response = await self.trigger_step_function_execution(
+               trigger_step_function_execution_response = await timed("step_function", self.trigger_step_function_execution(
                     memory_id, 
                     search_images_result.data if search_images_result.data else []
-               )
+               ))
 
                if not trigger_step_function_execution_response.success:
                     return trigger_step_function_execution_response
                
-               update_status_of_memory_in_mongodb_result = await self.update_status_of_memory_in_mongodb(
+               update_status_of_memory_in_mongodb_result = await timed("update_status", self.update_status_of_memory_in_mongodb(
                     memory_id=memory_id,
                     images=search_images_result.data,
                     video_url=f"https://{AWS_VIDEO_OUTPUT_BUCKET}.s3.{AWS_REGION}.amazonaws.com/image-to-video/{memory_id}.mp4",
                     status="processing",
-               )
+               ))
 
                if not update_status_of_memory_in_mongodb_result.success:
                     return update_status_of_memory_in_mongodb_result
@@ -1,56 +1,117 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import random
+import socket
+import uuid
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from typing import Optional
+from dotenv import load_dotenv # type: ignore
 from loguru import logger # type: ignore
-from utils.models import Models
-from utils.mongodb import MongodbDatabase
-from utils.pinecone import PineconeDatabase
+from utils.clustering import cluster_faces
+from utils.face_embeddings import FaceEmbeddingMatrix
+from utils.mongodb import MongodbDatabase, cluster_images_id
+from utils.pinecone import FACE_CLUSTERS_FIELD, PineconeDatabase
 from utils.response import AppResponse, ErrorResponse, ServerErrorResponse, SuccessResponse
 from bson import ObjectId
+from pymongo import ReplaceOne
 import numpy as np
-import sklearn
-from sklearn.cluster import DBSCAN
+from sklearn.metrics import adjusted_rand_score
+
+load_dotenv()
+
+# "full" reruns DBSCAN on every face each time; "incremental" assigns new faces to stored centroids
+CLUSTERING_MODE = os.getenv("CLUSTERING_MODE", "full")
+# Maximum euclidean distance from a centroid for a new face to join that cluster
+CLUSTER_ASSIGN_DISTANCE = float(os.getenv("CLUSTER_ASSIGN_DISTANCE", "0.5"))
+# Fall back to a full recluster once this share of faces (or of the new faces) is unassigned/noise
+CLUSTER_NOISE_RATIO_THRESHOLD = float(os.getenv("CLUSTER_NOISE_RATIO_THRESHOLD", "0.2"))
+# Force a full recluster at least this often; picks up older faces from newly joined experiences
+CLUSTER_FULL_RECLUSTER_HOURS = float(os.getenv("CLUSTER_FULL_RECLUSTER_HOURS", "24"))
+# Share of incremental runs that are also checked against a full recluster
+CLUSTER_VALIDATION_SAMPLE_RATE = float(os.getenv("CLUSTER_VALIDATION_SAMPLE_RATE", "0.05"))
+FACE_EMBEDDING_FETCH_BATCH_SIZE = int(os.getenv("FACE_EMBEDDING_FETCH_BATCH_SIZE", "1000"))
+
+# Recluster users on a process pool instead of one after another
+CLUSTER_PARALLEL = os.getenv("CLUSTER_PARALLEL", "false").lower() == "true"
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", "0")) or len(os.sched_getaffinity(0))
+# Containers running the job split users by hash(user_id) % CLUSTER_SHARD_COUNT
+CLUSTER_SHARD_COUNT = int(os.getenv("CLUSTER_SHARD_COUNT", "1"))
+CLUSTER_SHARD_INDEX = int(os.getenv("CLUSTER_SHARD_INDEX", "0"))
+# How long a worker may hold a user's face_cluster document before others may take it over
+CLUSTER_LEASE_SECONDS = float(os.getenv("CLUSTER_LEASE_SECONDS", "1800"))
+# Write-and-recheck rounds of the face_clusters sync before giving up on images other runs keep changing
+PINECONE_SYNC_MAX_ROUNDS = int(os.getenv("PINECONE_SYNC_MAX_ROUNDS", "5"))
+
+NOISE_LABEL = "-1"
+
+def face_key(img_id, bounding_box) -> tuple:
+    return (str(img_id), tuple(bounding_box))
+
+def user_shard(user_id: str, shard_count: int) -> int:
+    """Stable across processes and hosts, unlike the builtin hash()."""
+    return int(hashlib.sha1(str(user_id).encode()).hexdigest(), 16) % max(1, shard_count)
+
+_worker_loop = None
+_worker_face_classification = None
+
+def _init_cluster_worker():
+    """Process pool initializer: one event loop and Mongo client per worker process."""
+    global _worker_loop, _worker_face_classification
+    _worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_worker_loop)
+    # Parallelism comes from the pool; a multi-threaded DBSCAN per worker would oversubscribe the cores
+    _worker_face_classification = FaceClassification(MongodbDatabase(), PineconeDatabase(), dbscan_n_jobs=1)
+
+def _run_cluster_worker(user_id: str) -> tuple[bool, str]:
+    result = _worker_loop.run_until_complete(_worker_face_classification.handle_leased_request(user_id))
+    return result.success, result.message
 
 class FaceClassification():
 
-    def __init__(self, mongodb: MongodbDatabase):
+    def __init__(self, mongodb: MongodbDatabase, pinecone: Optional[PineconeDatabase] = None, dbscan_n_jobs: int = -1):
         self.mongodb = mongodb
+        self.pinecone = pinecone
+        self.dbscan_n_jobs = dbscan_n_jobs
 
-    async def fetch_face_embeddings_from_mongodb(self, user_id: str) -> AppResponse:
+    async def fetch_face_embeddings_from_mongodb(self, user_id: str, created_after: Optional[datetime] = None) -> AppResponse:
+        """Stream the user's face documents into a FaceEmbeddingMatrix, one cursor batch at a time."""
         try:
-            aggregate_result = await self.mongodb.experience_participant_collection.aggregate([
+            participations = await self.mongodb.experience_participant_collection.find(
                 {
-                    '$match': {
-                        'participants': {
-                            '$elemMatch': {
-                                'user_id': ObjectId(user_id)
-                            }
-                        }
-                    }
-                }, {
-                    '$lookup': {
-                        'from': 'face_embeddings', 
-                        'localField': 'experience_id', 
-                        'foreignField': 'experience_id', 
-                        'as': 'face_embeddings'
-                    }
-                }, {
-                    '$unwind': '$face_embeddings'
-                }, {
-                    '$group': {
-                        '_id': None, 
-                        'all_embeddings': {
-                            '$push': '$face_embeddings'
+                    'participants': {
+                        '$elemMatch': {
+                            'user_id': ObjectId(user_id)
                         }
                     }
-                }
-            ]).to_list()
+                },
+                projection={'experience_id': 1, '_id': 0}
+            ).to_list(None)
 
-            all_images_doc = []
-            
-            if aggregate_result and isinstance(aggregate_result, list) and len(aggregate_result) > 0:
-                all_images_doc = aggregate_result[0].get("all_embeddings")    
+            experience_ids = list({participation['experience_id'] for participation in participations if participation.get('experience_id')})
+            face_matrix = FaceEmbeddingMatrix()
 
-            return SuccessResponse("Successfully fetched face embeddings from mongodb", all_images_doc)
+            if not experience_ids:
+                return SuccessResponse("Successfully fetched face embeddings from mongodb", face_matrix)
+
+            query = {'experience_id': {'$in': experience_ids}}
+            if created_after:
+                query['created_at'] = {'$gt': created_after}
+
+            cursor = self.mongodb.face_embeddings_collection.find(
+                query,
+                projection={'_id': 1, 'image_url': 1, 'faces.encoding': 1, 'faces.bounding_box': 1}
+            ).batch_size(FACE_EMBEDDING_FETCH_BATCH_SIZE)
+
+            async for image in cursor:
+                image_index = face_matrix.add_image(image['_id'], image.get('image_url'))
+                for face in image.get('faces') or []:
+                    face_matrix.add_face(image_index, face['encoding'], face['bounding_box'])
+
+            return SuccessResponse("Successfully fetched face embeddings from mongodb", face_matrix)
         except Exception as e:
            logger.exception(f"Exception at FaceClassification fetch_face_embeddings_from_mongodb", exc_info=True)
            return ServerErrorResponse(f"Exception at FaceClassification fetch_face_embeddings_from_mongodb", e)
@@ -65,10 +126,41 @@ class FaceClassification():
             logger.exception(f"Exception at FaceClassification fetch_cluster_document", exc_info=True)
             return ServerErrorResponse(f"Exception at FaceClassification fetch_cluster_document", e)
         
-    async def update_cluster_document(self, user_id: str, cluster_doc: dict) -> AppResponse:
+    async def acquire_lease(self, user_id: str, lease_owner: str) -> bool:
+        """Claim the user's face_cluster document unless another worker holds an unexpired lease."""
+        now = datetime.now()
+        leased = await self.mongodb.face_cluster_collection.find_one_and_update(
+            {
+                "_id": ObjectId(user_id),
+                "$or": [
+                    {"lease_until": None},
+                    {"lease_until": {"$lt": now}}
+                ]
+            },
+            {"$set": {"lease_owner": lease_owner, "lease_until": now + timedelta(seconds=CLUSTER_LEASE_SECONDS)}},
+            projection={"_id": 1}
+        )
+        return leased is not None
+
+    async def release_lease(self, user_id: str, lease_owner: str):
         try:
+            await self.mongodb.face_cluster_collection.update_one(
+                {"_id": ObjectId(user_id), "lease_owner": lease_owner},
+                {"$unset": {"lease_owner": "", "lease_until": ""}}
+            )
+        except Exception as e:
+            logger.exception(f"Exception at FaceClassification release_lease", exc_info=True)
+
+    async def update_cluster_document(self, user_id: str, cluster_doc: dict, lease_owner: Optional[str] = None) -> AppResponse:
+        try:
+            query = {"_id": ObjectId(user_id), "user_id": ObjectId(user_id)}
+
+            # Only write if we still hold the lease; the replacement drops the lease fields, releasing it
+            if lease_owner:
+                query["lease_owner"] = lease_owner
+
             replace_one_response = await self.mongodb.face_cluster_collection.replace_one(
-                {"_id": ObjectId(user_id), "user_id": ObjectId(user_id)},
+                query,
                 {
                     **cluster_doc,
                     "user_id": ObjectId(user_id)
@@ -83,19 +175,120 @@ class FaceClassification():
             logger.exception(f"Exception at FaceClassification update_cluster_document", exc_info=True)
             return ServerErrorResponse(f"Exception at FaceClassification update_cluster_document", e)
 
-    async def cluster_embeddings(self, images_list: list, exisiting_data: dict) -> AppResponse:
+    async def update_cluster_images(self, user_id: str, cluster_doc: dict) -> AppResponse:
+        """Rewrite the user's cluster key -> img_ids lookup in face_cluster_images and drop entries for clusters that no longer exist."""
         try:
-            all_faces = []
-            face_refs = []
-            for img in images_list:
-                image_id = img["_id"]
-                image_url = img["image_url"]
-
-                for face_index, face in enumerate(img["faces"]):
-                    all_faces.append(np.array(face["encoding"]))
-                    face_refs.append((image_id, face_index, image_url, face["bounding_box"]))
-    
-            if not all_faces:
+            updated_at = datetime.now()
+            document_ids = []
+            operations = []
+
+            for cluster_key, value in cluster_doc.get("clusters", {}).items():
+                img_ids = sorted({face["img_id"] for face in value.get("faces", [])})
+                document_ids.append(cluster_images_id(user_id, cluster_key))
+                operations.append(ReplaceOne(
+                    {"_id": document_ids[-1]},
+                    {
+                        "user_id": ObjectId(user_id),
+                        "cluster_key": cluster_key,
+                        "img_ids": img_ids,
+                        "updated_at": updated_at
+                    },
+                    upsert=True
+                ))
+
+            if operations:
+                await self.mongodb.face_cluster_images_collection.bulk_write(operations, ordered=False)
+
+            # An anchored prefix regex on _id is an index range scan
+            await self.mongodb.face_cluster_images_collection.delete_many({
+                "_id": {
+                    "$regex": f"^{user_id}:",
+                    "$nin": document_ids
+                }
+            })
+
+            return SuccessResponse(f"Successfully updated {len(operations)} cluster image lists", None)
+        except Exception as e:
+            logger.exception(f"Exception at FaceClassification update_cluster_images", exc_info=True)
+            return ServerErrorResponse(f"Exception at FaceClassification update_cluster_images", e)
+
+    def cluster_memberships(self, user_id: str, cluster_doc: Optional[dict]) -> dict:
+        """img_id -> the face_clusters entries this user's clusters give that image."""
+        memberships = defaultdict(set)
+        for cluster_key, value in (cluster_doc or {}).get("clusters", {}).items():
+            for face in value.get("faces", []):
+                memberships[str(face["img_id"])].add(cluster_images_id(user_id, cluster_key))
+        return memberships
+
+    async def sync_pinecone_clusters(self, user_id: str, cluster_doc: dict, exisiting_data: Optional[dict], reconcile_all: bool = True) -> AppResponse:
+        """Bring the face_clusters metadata of the user's image vectors in line with face_cluster_images.
+
+        Only images whose membership in this user's clusters changed against the previous document are
+        checked, or every image of the user with reconcile_all. Each image's list is rebuilt from
+        face_cluster_images, which holds every user's clusters, rather than patched from what Pinecone
+        returned: two users reclustering a shared image at once would otherwise overwrite each other's
+        entries. After writing, the lists are read again and images another run changed in the meantime
+        are rewritten, so whichever run writes last leaves the current lists behind.
+        """
+        try:
+            memberships = self.cluster_memberships(user_id, cluster_doc)
+            previous_memberships = self.cluster_memberships(user_id, exisiting_data)
+            image_ids = set(memberships) | set(previous_memberships)
+
+            if not reconcile_all:
+                image_ids = {img_id for img_id in image_ids if memberships.get(img_id) != previous_memberships.get(img_id)}
+
+            fetch_metadata_result = await self.pinecone.fetch_metadata(sorted(image_ids))
+
+            if not fetch_metadata_result.success:
+                return fetch_metadata_result
+
+            stored = fetch_metadata_result.data
+            wanted = await self.mongodb.fetch_image_face_clusters(list(stored))
+            # Vectors not in Pinecone yet get their list when process_image upserts them
+            updates = {
+                img_id: {FACE_CLUSTERS_FIELD: face_clusters}
+                for img_id, face_clusters in wanted.items()
+                if sorted(stored[img_id].get(FACE_CLUSTERS_FIELD) or []) != face_clusters
+            }
+            updated = set()
+
+            for _ in range(PINECONE_SYNC_MAX_ROUNDS):
+                if not updates:
+                    break
+
+                update_metadata_result = await self.pinecone.update_metadata(updates)
+
+                if not update_metadata_result.success:
+                    return update_metadata_result
+
+                updated |= set(updates)
+                current = await self.mongodb.fetch_image_face_clusters(list(updates))
+                updates = {
+                    img_id: {FACE_CLUSTERS_FIELD: current[img_id]}
+                    for img_id, fields in updates.items()
+                    if current[img_id] != fields[FACE_CLUSTERS_FIELD]
+                }
+
+            if updates:
+                return ErrorResponse(f"face_clusters of {len(updates)} image vectors still changing after {PINECONE_SYNC_MAX_ROUNDS} rounds", data=sorted(updates))
+
+            return SuccessResponse(f"Checked {len(image_ids)} image vectors, updated {len(updated)}", None)
+        except Exception as e:
+            logger.exception(f"Exception at FaceClassification sync_pinecone_clusters", exc_info=True)
+            return ServerErrorResponse(f"Exception at FaceClassification sync_pinecone_clusters", e)
+
+    async def mark_pinecone_synced(self, user_id: str, synced: bool):
+        """Album and memory search only filter Pinecone on cluster keys once the user's vectors are in sync."""
+        try:
+            update = {"$set": {"pinecone_synced_at": datetime.now()}} if synced else {"$unset": {"pinecone_synced_at": ""}}
+            await self.mongodb.face_cluster_collection.update_one({"_id": ObjectId(user_id)}, update)
+        except Exception as e:
+            logger.exception(f"Exception at FaceClassification mark_pinecone_synced", exc_info=True)
+
+    async def cluster_embeddings(self, face_matrix: FaceEmbeddingMatrix, exisiting_data: dict) -> AppResponse:
+        try:
+            if not len(face_matrix):
                 cluster_doc = {
                     "clusters": {},
                     "cluster_count": 0,
@@ -105,17 +298,13 @@ class FaceClassification():
 
                 return SuccessResponse("Successfully clustered images", cluster_doc)
 
-            encodings = np.array(all_faces)
-            clustering = DBSCAN(metric="euclidean", n_jobs=-1).fit(encodings)
-            labels = [int(label) for label in clustering.labels_]
+            encodings = face_matrix.encodings
+            labels = [int(label) for label in cluster_faces(encodings, n_jobs=self.dbscan_n_jobs)]
+            centroids = self.compute_centroids(encodings, labels)
     
             cluster_data = defaultdict(list)
-            for (img_id, _, image_url, bounding_box), label in zip(face_refs, labels):
-                cluster_data[label].append({
-                    "img_id": img_id,
-                    "image_url": image_url,
-                    "bounding_box": bounding_box
-                })
+            for row, label in enumerate(labels):
+                cluster_data[label].append(face_matrix.member(row))
 
             clusters = {
                 str(cluster_id): sorted(members, key=lambda x: x["img_id"])
@@ -134,13 +323,16 @@ class FaceClassification():
                             members,
                             key=lambda x: x["img_id"]
                         ),
-                        "name": cluster_name.get(str(cluster_id), "")
+                        "name": cluster_name.get(str(cluster_id), ""),
+                        "member_count": len(members),
+                        "centroid": centroids.get(cluster_id)
                     }
                     for cluster_id, members in cluster_data.items()
                 },
                 "cluster_count": len(clusters),
-                "total_faces": len(all_faces),
-                "updated_at": datetime.now()
+                "total_faces": len(face_matrix),
+                "updated_at": datetime.now(),
+                "full_clustered_at": datetime.now()
             }
 
             return SuccessResponse("Successfully clustered images", cluster_doc)
@@ -149,6 +341,132 @@ class FaceClassification():
             logger.exception(f"Exception at FaceClassification cluster_embeddings", exc_info=True)
             return ServerErrorResponse(f"Exception at FaceClassification cluster_embeddings", e)
         
+    def compute_centroids(self, encodings: np.ndarray, labels: list) -> dict:
+        """Mean encoding per cluster label, as plain float lists for storage. Noise has no centroid."""
+        labels = np.asarray(labels)
+        return {
+            int(label): encodings[labels == label].mean(axis=0).astype(float).tolist()
+            for label in np.unique(labels)
+            if label != -1
+        }
+
+    def assign_new_faces(self, face_matrix: FaceEmbeddingMatrix, exisiting_data: dict) -> AppResponse:
+        """Add faces from new images to the nearest stored centroid.
+
+        Returns the updated cluster document, or None as data when the result would be too noisy
+        and a full recluster is needed.
+        """
+        try:
+            clusters = {key: dict(value) for key, value in exisiting_data.get("clusters", {}).items()}
+            centroid_keys = [key for key, value in clusters.items() if key != NOISE_LABEL and value.get("centroid")]
+
+            if not centroid_keys:
+                return SuccessResponse("No centroids stored, full recluster needed", None)
+
+            # Reprocessed images replace their earlier faces rather than adding duplicates
+            new_image_ids = {str(img_id) for img_id in face_matrix.image_ids}
+            total_faces = 0
+            for value in clusters.values():
+                kept = [face for face in value.get("faces", []) if str(face["img_id"]) not in new_image_ids]
+                if value.get("member_count") is not None:
+                    value["member_count"] = max(0, value["member_count"] - (len(value.get("faces", [])) - len(kept)))
+                value["faces"] = kept
+                total_faces += len(kept)
+
+            centroids = np.array([clusters[key]["centroid"] for key in centroid_keys], dtype=np.float64)
+            member_counts = np.array([clusters[key].get("member_count") or len(clusters[key]["faces"]) for key in centroid_keys], dtype=np.float64)
+
+            new_faces = len(face_matrix)
+            unassigned = 0
+            for row, encoding in enumerate(face_matrix.encodings):
+                member = face_matrix.member(row)
+
+                distances = np.linalg.norm(centroids - encoding, axis=1)
+                nearest = int(np.argmin(distances))
+
+                if distances[nearest] > CLUSTER_ASSIGN_DISTANCE:
+                    unassigned += 1
+                    clusters.setdefault(NOISE_LABEL, {"faces": [], "name": ""})["faces"].append(member)
+                    continue
+
+                # Running mean keeps the centroid exact without the old encodings
+                member_counts[nearest] += 1
+                centroids[nearest] += (encoding - centroids[nearest]) / member_counts[nearest]
+                clusters[centroid_keys[nearest]]["faces"].append(member)
+
+            total_faces += new_faces
+            noise_faces = len(clusters.get(NOISE_LABEL, {}).get("faces", []))
+
+            if total_faces and noise_faces / total_faces > CLUSTER_NOISE_RATIO_THRESHOLD:
+                return SuccessResponse(f"Noise ratio {noise_faces}/{total_faces} over threshold, full recluster needed", None)
+
+            if new_faces and unassigned / new_faces > CLUSTER_NOISE_RATIO_THRESHOLD:
+                return SuccessResponse(f"Unassigned ratio {unassigned}/{new_faces} over threshold, full recluster needed", None)
+
+            for index, key in enumerate(centroid_keys):
+                clusters[key]["centroid"] = centroids[index].tolist()
+                clusters[key]["member_count"] = int(member_counts[index])
+
+            for value in clusters.values():
+                value["faces"] = sorted(value["faces"], key=lambda x: x["img_id"])
+
+            cluster_doc = {
+                **{key: value for key, value in exisiting_data.items() if key not in ("_id", "user_id") and not key.startswith("lease_")},
+                "clusters": clusters,
+                "cluster_count": len(clusters),
+                "total_faces": total_faces,
+                "updated_at": datetime.now()
+            }
+
+            return SuccessResponse(f"Assigned {new_faces - unassigned} of {new_faces} new faces incrementally", cluster_doc)
+
+        except Exception as e:
+            logger.exception(f"Exception at FaceClassification assign_new_faces", exc_info=True)
+            return ServerErrorResponse(f"Exception at FaceClassification assign_new_faces", e)
+
+    def needs_full_recluster(self, exisiting_data: Optional[dict]) -> bool:
+        if CLUSTERING_MODE != "incremental" or not exisiting_data or not exisiting_data.get("clusters"):
+            return True
+
+        full_clustered_at = exisiting_data.get("full_clustered_at")
+        if not full_clustered_at or not exisiting_data.get("clustered_until"):
+            return True
+
+        return datetime.now() - full_clustered_at > timedelta(hours=CLUSTER_FULL_RECLUSTER_HOURS)
+
+    async def validate_incremental_result(self, user_id: str, cluster_doc: dict, exisiting_data: dict):
+        """Compare an incremental result with a full recluster of the same faces and log the agreement."""
+        try:
+            fetch_result = await self.fetch_face_embeddings_from_mongodb(user_id)
+            if not fetch_result.success:
+                return
+
+            full_result = await self.cluster_embeddings(fetch_result.data, exisiting_data)
+            if not full_result.success:
+                return
+
+            def labels_by_face(doc):
+                return {
+                    face_key(face["img_id"], face["bounding_box"]): key
+                    for key, value in doc["clusters"].items()
+                    for face in value["faces"]
+                }
+
+            incremental_labels = labels_by_face(cluster_doc)
+            full_labels = labels_by_face(full_result.data)
+            shared_faces = [face for face in full_labels if face in incremental_labels]
+
+            if not shared_faces:
+                return
+
+            score = adjusted_rand_score(
+                [full_labels[face] for face in shared_faces],
+                [incremental_labels[face] for face in shared_faces]
+            )
+            logger.info(f"Incremental clustering validation for user {user_id}: adjusted rand index {score:.4f} over {len(shared_faces)} faces")
+        except Exception as e:
+            logger.exception(f"Exception at FaceClassification validate_incremental_result", exc_info=True)
+
     async def handle_individual_request(self, request: dict)-> AppResponse:
         try:
             if not isinstance(request, dict):
@@ -161,32 +479,79 @@ class FaceClassification():
                 logger.exception("Not all required fields provided for processing image at FaceClassification handle_individual_request", request)
                 return ErrorResponse("user_id not provided for processing image at FaceClassification handle_individual_request", request)
             
-            fetch_face_embeddings_from_mongodb_result = await self.fetch_face_embeddings_from_mongodb(user_id)
+            # Faces created while this run is in progress are picked up by the next one
+            run_started_at = datetime.now()
 
-            if not fetch_face_embeddings_from_mongodb_result.success:
-                return fetch_face_embeddings_from_mongodb_result
-            
-            images__docs_list = fetch_face_embeddings_from_mongodb_result.data
-            
             fetch_cluster_document_result = await self.fetch_cluster_document(user_id)
 
             if not fetch_cluster_document_result.success:
                 return fetch_cluster_document_result
             
             exisiting_cluster_data = fetch_cluster_document_result.data
-            
-            cluster_embeddings_result = await self.cluster_embeddings(images__docs_list, exisiting_cluster_data)
+            cluster_doc = None
+            # Incremental runs only sync images whose membership changed; full runs reconcile every image
+            reconcile_all = False
 
-            if not cluster_embeddings_result.success:
-                return cluster_embeddings_result
-            
-            cluster_doc = cluster_embeddings_result.data
+            if not self.needs_full_recluster(exisiting_cluster_data):
+                fetch_face_embeddings_from_mongodb_result = await self.fetch_face_embeddings_from_mongodb(user_id, exisiting_cluster_data["clustered_until"])
+
+                if not fetch_face_embeddings_from_mongodb_result.success:
+                    return fetch_face_embeddings_from_mongodb_result
+
+                assign_new_faces_result = self.assign_new_faces(fetch_face_embeddings_from_mongodb_result.data, exisiting_cluster_data)
+
+                if not assign_new_faces_result.success:
+                    return assign_new_faces_result
+
+                logger.info(f"FaceClassification incremental run for user {user_id}: {assign_new_faces_result.message}")
+                cluster_doc = assign_new_faces_result.data
+
+                if cluster_doc and random.random() < CLUSTER_VALIDATION_SAMPLE_RATE:
+                    await self.validate_incremental_result(user_id, cluster_doc, exisiting_cluster_data)
+
+            if cluster_doc is None:
+                fetch_face_embeddings_from_mongodb_result = await self.fetch_face_embeddings_from_mongodb(user_id)
+
+                if not fetch_face_embeddings_from_mongodb_result.success:
+                    return fetch_face_embeddings_from_mongodb_result
+                
+                face_matrix = fetch_face_embeddings_from_mongodb_result.data
+                
+                cluster_embeddings_result = await self.cluster_embeddings(face_matrix, exisiting_cluster_data)
+
+                if not cluster_embeddings_result.success:
+                    return cluster_embeddings_result
+                
+                cluster_doc = cluster_embeddings_result.data
+                reconcile_all = True
+
+            cluster_doc["clustered_until"] = run_started_at
+
+            pinecone_synced_at = (exisiting_cluster_data or {}).get("pinecone_synced_at")
+            if pinecone_synced_at:
+                cluster_doc["pinecone_synced_at"] = pinecone_synced_at
+            else:
+                reconcile_all = True
             print("cluster_doc", cluster_doc)
 
-            update_cluster_document_result = await self.update_cluster_document(user_id, cluster_doc)
+            update_cluster_document_result = await self.update_cluster_document(user_id, cluster_doc, request.get("lease_owner"))
 
             if not update_cluster_document_result.success:
                 return update_cluster_document_result
+
+            update_cluster_images_result = await self.update_cluster_images(user_id, cluster_doc)
+
+            if not update_cluster_images_result.success:
+                return update_cluster_images_result
+
+            if self.pinecone:
+                sync_pinecone_clusters_result = await self.sync_pinecone_clusters(user_id, cluster_doc, exisiting_cluster_data, reconcile_all)
+                logger.info(f"FaceClassification Pinecone sync for user {user_id}: {sync_pinecone_clusters_result.message}")
+                # A failed sync clears the marker, so search falls back to img_id filters and the next run reconciles everything
+                await self.mark_pinecone_synced(user_id, sync_pinecone_clusters_result.success)
+
+                if not sync_pinecone_clusters_result.success:
+                    return sync_pinecone_clusters_result
             
             return SuccessResponse(f"Successfully clustered all faces for the user {user_id}")
 
@@ -195,6 +560,22 @@ class FaceClassification():
                logger.exception(f"Exception at FaceClassification handle_individual_request", exc_info=True)
                return ServerErrorResponse(f"Exception at FaceClassification handle_individual_request", e)
         
+    async def handle_leased_request(self, user_id: str) -> AppResponse:
+        """Recluster one user while holding the lease on their face_cluster document."""
+        lease_owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        try:
+            if not await self.acquire_lease(user_id, lease_owner):
+                return SuccessResponse(f"Skipped user {user_id}, another worker holds the lease")
+        except Exception as e:
+            logger.exception(f"Exception at FaceClassification handle_leased_request", exc_info=True)
+            return ServerErrorResponse(f"Exception at FaceClassification handle_leased_request", e)
+
+        try:
+            return await self.handle_individual_request({"user_id": user_id, "lease_owner": lease_owner})
+        finally:
+            await self.release_lease(user_id, lease_owner)
+
     async def handle_request(self)-> AppResponse:
         try:
             time_threshold = datetime.utcnow() - timedelta(hours=1)
@@ -211,8 +592,38 @@ class FaceClassification():
                 }
             ).to_list(None)
 
-            for data in face_cluster_list:
-                await self.handle_individual_request({"user_id": str(data.get("user_id"))})
+            user_ids = [
+                str(data.get("user_id"))
+                for data in face_cluster_list
+                if user_shard(data.get("user_id"), CLUSTER_SHARD_COUNT) == CLUSTER_SHARD_INDEX
+            ]
+            await self.mongodb.create_indexes()
+            logger.info(f"FaceClassification shard {CLUSTER_SHARD_INDEX}/{CLUSTER_SHARD_COUNT}: {len(user_ids)} of {len(face_cluster_list)} stale users")
+
+            if not CLUSTER_PARALLEL or len(user_ids) <= 1:
+                for user_id in user_ids:
+                    await self.handle_leased_request(user_id)
+
+                return SuccessResponse(f"Clustered {len(user_ids)} users")
+
+            loop = asyncio.get_running_loop()
+            with ProcessPoolExecutor(
+                max_workers=min(CLUSTER_WORKERS, len(user_ids)),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_cluster_worker
+            ) as executor:
+                results = await asyncio.gather(
+                    *[loop.run_in_executor(executor, _run_cluster_worker, user_id) for user_id in user_ids],
+                    return_exceptions=True
+                )
+
+            for user_id, result in zip(user_ids, results):
+                if isinstance(result, Exception):
+                    logger.error(f"FaceClassification worker failed for user {user_id}: {result}")
+                elif not result[0]:
+                    logger.error(f"FaceClassification failed for user {user_id}: {result[1]}")
+
+            return SuccessResponse(f"Clustered {len(user_ids)} users")
 
         except Exception as e:
                logger.exception(f"Exception at FaceClassification handle_individual_request", exc_info=True)
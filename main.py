@@ -1,20 +1,59 @@
+import time
+
+STARTED_AT = time.perf_counter()
+
 import datetime
 import json
-from album_memory_creation import AlbumMemoryCreation
-from face_classification import FaceClassification
+import os
+import signal
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Optional
 from loguru import logger # type: ignore
 import asyncio
-from process_image import ProcessImage
-from utils.groq import GroqApi
 from utils.logger import setup_logger
-from utils.models import Models
+from utils.metrics import METRICS_EXPORT, span_metrics, start_message
 from utils.mongodb import MongodbDatabase
 from utils.pinecone import PineconeDatabase
 from utils.response import AppResponse, ErrorResponse, ServerErrorResponse
-from utils.sqs import SQS
-from utils.step_function import StepFunction
+from utils.sqs import SQS, SQS_MAX_MESSAGES
+from utils.worker_pool import WorkerPool
+from dotenv import load_dotenv # type: ignore
+
+# The role modules pull in torch, open_clip, cv2 or sklearn; each role imports only its own
+if TYPE_CHECKING:
+    from album_memory_creation import AlbumMemoryCreation
+    from process_image import ProcessImage
+
+load_dotenv()
+
+# "ingest" (image uploads), "search" (album and memory prompts), "clustering" (face clustering job) or "all"
+WORKER_ROLE = os.getenv("WORKER_ROLE", "all")
+ROLE_ACTIONS = {
+    "all": {"EXPERIENCE_IMAGE_UPLOADED", "ALBUM_CREATION_REQUEST", "MEMORY_CREATION_AI"},
+    "ingest": {"EXPERIENCE_IMAGE_UPLOADED"},
+    "search": {"ALBUM_CREATION_REQUEST", "MEMORY_CREATION_AI"},
+    "clustering": set(),
+}
+# Start loading the model in the background at startup instead of on the first message
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+
+first_message_logged = False
+
+MESSAGE_CONCURRENCY = int(os.getenv("MESSAGE_CONCURRENCY", "1"))
+ACTION_CONCURRENCY = {
+    "EXPERIENCE_IMAGE_UPLOADED": int(os.getenv("IMAGE_UPLOAD_CONCURRENCY", "0")),
+    "ALBUM_CREATION_REQUEST": int(os.getenv("ALBUM_CREATION_CONCURRENCY", "0")),
+    "MEMORY_CREATION_AI": int(os.getenv("MEMORY_CREATION_CONCURRENCY", "0")),
+}
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "60"))
+
+def log_time_to_first_message():
+    global first_message_logged
+    if not first_message_logged:
+        first_message_logged = True
+        logger.info(f"Time to first message for role {WORKER_ROLE}: {time.perf_counter() - STARTED_AT:.1f}s since process start")
 
-async def process_individual_message(message, sqs: SQS, process_image: ProcessImage, album_creation: AlbumMemoryCreation) -> AppResponse:
+async def process_individual_message(message, sqs: SQS, process_image: Optional["ProcessImage"], album_creation: Optional["AlbumMemoryCreation"], worker_pool: Optional[WorkerPool] = None) -> AppResponse:
     try:
         print("message", message)
         receipt_handle = message.get('ReceiptHandle')
@@ -25,16 +64,26 @@ async def process_individual_message(message, sqs: SQS, process_image: ProcessIm
             logger.info(f"Processing message {message_id}")
             message_dict = json.loads(body)
             action = message_dict.get("action")
+            message_spans = start_message(action, message_id)
 
-            if action == "EXPERIENCE_IMAGE_UPLOADED":
-                result = await process_image.handle_request(message_dict)
-            elif action == "ALBUM_CREATION_REQUEST":
-                result = await album_creation.handle_album_request(message_dict)
-            elif action == "MEMORY_CREATION_AI":
-                result = await album_creation.handle_memory_request(message_dict)
-            else:
-                logger.exception(f"Invalid action: {action} at process_individual_message")
-                return ErrorResponse(f"Invalid action: {action} at process_individual_message")
+            if action in ROLE_ACTIONS["all"] and action not in ROLE_ACTIONS.get(WORKER_ROLE, ROLE_ACTIONS["all"]):
+                # Split deployments should give each role its own SQS_QUEUE_URL; this only keeps strays moving
+                logger.warning(f"Releasing {action} message {message_id}, not handled by the {WORKER_ROLE} role")
+                return await sqs.release_sqs_message(receipt_handle)
+
+            async with (worker_pool.action_slot(action) if worker_pool else nullcontext()):
+                if action == "EXPERIENCE_IMAGE_UPLOADED":
+                    result = await process_image.handle_request(message_dict)
+                elif action == "ALBUM_CREATION_REQUEST":
+                    result = await album_creation.handle_album_request(message_dict)
+                elif action == "MEMORY_CREATION_AI":
+                    result = await album_creation.handle_memory_request(message_dict)
+                else:
+                    logger.exception(f"Invalid action: {action} at process_individual_message")
+                    return ErrorResponse(f"Invalid action: {action} at process_individual_message")
+            log_time_to_first_message()
+            # Lazy, so the summary is only built when DEBUG is enabled
+            logger.opt(lazy=True).debug("Message {} {} spans: {}", lambda: message_id, lambda: action, message_spans.summary)
             print("result", result.success, result.message)
             if not result.success:
                 logger.exception(f"{action} action failed at process_individual_message: {result}")
@@ -53,17 +102,63 @@ async def process_individual_message(message, sqs: SQS, process_image: ProcessIm
         logger.exception(f"Exception at process_individual_message")
 
 async def process_messages():
+    worker_pool = WorkerPool(MESSAGE_CONCURRENCY, ACTION_CONCURRENCY)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    sqs = None
+    process_image = None
+    album_creation = None
+    pinecone_database = None
+    mongodb_database = None
+    models = None
+    warmup_task = None
+    actions = ROLE_ACTIONS.get(WORKER_ROLE, ROLE_ACTIONS["all"])
+
+    if not actions:
+        return
+
     try:
+        from utils.models import IMAGE_TOWER, TEXT_TOWER, Models
+
         sqs = SQS()
-        step_function = StepFunction()
-        models = Models()
         pinecone_database = PineconeDatabase()
         mongodb_database = MongodbDatabase()
-        groq_api = GroqApi()
-        process_image = ProcessImage(models, pinecone_database, mongodb_database)
-        album_creation = AlbumMemoryCreation(models, pinecone_database, mongodb_database, groq_api, step_function)
-        while True:
-            response = await sqs.get_sqs_messages()
+        # Ingest looks images up in face_cluster_images before the clustering job has ever run
+        await mongodb_database.create_indexes()
+        models = Models(towers=tuple(
+            tower for tower, needed in (
+                (IMAGE_TOWER, "EXPERIENCE_IMAGE_UPLOADED" in actions),
+                (TEXT_TOWER, bool(actions & {"ALBUM_CREATION_REQUEST", "MEMORY_CREATION_AI"}))
+            ) if needed
+        ))
+
+        if "EXPERIENCE_IMAGE_UPLOADED" in actions:
+            from process_image import ProcessImage
+            process_image = ProcessImage(models, pinecone_database, mongodb_database)
+
+        if actions & {"ALBUM_CREATION_REQUEST", "MEMORY_CREATION_AI"}:
+            from album_memory_creation import AlbumMemoryCreation
+            from utils.groq import GroqApi
+            from utils.step_function import StepFunction
+            album_creation = AlbumMemoryCreation(models, pinecone_database, mongodb_database, GroqApi(), StepFunction())
+
+        if MODEL_WARMUP:
+            # Overlaps the model load with the first SQS long poll
+            warmup_task = asyncio.create_task(models.inference.run(models.load, record=False))
+
+        span_metrics.start()
+        logger.info(f"Worker role {WORKER_ROLE} ready in {time.perf_counter() - STARTED_AT:.1f}s since process start")
+        logger.info(f"Processing messages with concurrency {worker_pool.max_in_flight}")
+        while not stop_event.is_set():
+            free_slots = await worker_pool.wait_for_free_slots()
+            response = await sqs.get_sqs_messages(min(SQS_MAX_MESSAGES, free_slots))
             if not response.success:
                 logger.exception(f"SQS message receiver failed: {response}")
                 break
@@ -73,21 +168,62 @@ async def process_messages():
                 break
 
             for message in response.data:
-                await process_individual_message(
+                try:
+                    message_dict = json.loads(message.get('Body', "{}"))
+                    if process_image and message_dict.get("action") == "EXPERIENCE_IMAGE_UPLOADED":
+                        process_image.prefetch(message_dict)
+                except Exception:
+                    # Malformed bodies are reported by process_individual_message
+                    pass
+
+            for message in response.data:
+                await worker_pool.submit(process_individual_message(
                     message = message,
                     sqs = sqs,
                     process_image = process_image,
-                    album_creation=album_creation
-                )
+                    album_creation=album_creation,
+                    worker_pool=worker_pool
+                ))
 
     except Exception as e:
         print("e", e)
         logger.exception(f"Exception at process_messages")
 
+    finally:
+        # Stop receiving first, then let in-flight messages finish so their deletes still go out
+        await worker_pool.shutdown(SHUTDOWN_TIMEOUT)
+
+        if warmup_task:
+            await asyncio.gather(warmup_task, return_exceptions=True)
+
+        if sqs:
+            await sqs.close()
+
+        if process_image:
+            await process_image.close()
+
+        if pinecone_database:
+            await pinecone_database.close()
+
+        if mongodb_database:
+            await mongodb_database.close()
+
+        if models:
+            logger.info(f"Inference stats: {models.inference.stats()}")
+            await models.inference.close()
+
+        if METRICS_EXPORT == "emf":
+            span_metrics.emit_emf()
+
 async def handle_face_classification():
+    if WORKER_ROLE not in ("all", "clustering"):
+        return
+
     try:
+        from face_classification import FaceClassification
+
         mongodb_database = MongodbDatabase()
-        face_classification = FaceClassification(mongodb_database)
+        face_classification = FaceClassification(mongodb_database, PineconeDatabase())
         await face_classification.handle_request()
     except Exception as e:
         logger.exception(f"Exception at handle_face_classification")
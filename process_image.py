@@ -1,18 +1,21 @@
-from multiprocessing import Process, Queue
+import asyncio
 from loguru import logger # type: ignore
+from utils.downloader import ImageDownloader
+from utils.embedding_batcher import EmbeddingBatcher
+from utils.face_detection import FaceDetectionPool
+from utils.face_embeddings import encode_face_encoding
+from utils.image_ingest import decode_image
+from utils.metrics import timed
 from utils.models import Models
 from utils.mongodb import MongodbDatabase
-from utils.pinecone import PineconeDatabase
+from utils.pinecone import FACE_CLUSTERS_FIELD, PineconeDatabase
 from utils.response import AppResponse, ErrorResponse, ServerErrorResponse, SuccessResponse
 from PIL import Image
 import cv2
-import torch
-import requests
-from io import BytesIO
-import numpy as np
-import face_recognition
 from bson import ObjectId
+from pymongo import UpdateOne
 import datetime
+import time
 
 video_extensions = (".mp4", ".mov", ".avi", ".mkv", ".flv", ".wmv", ".webm")
 
@@ -22,59 +25,71 @@ class ProcessImage():
         self.models = models
         self.pinecone = pinecone
         self.mongodb = mongodb
+        # Models loads lazily, so the model is only loaded once the first image arrives
+        self.embedding_batcher = EmbeddingBatcher(self.models.encode_image, self.models.device, self.models.inference)
+        self.downloader = ImageDownloader()
+        self.face_detection_pool = FaceDetectionPool()
 
-    async def extract_image_embedding_from_opencv(self, rgb_image) -> AppResponse:
-        try:
-            pil_image = Image.fromarray(cv2.cvtColor(rgb_image, cv2.COLOR_BGR2RGB))
+    def prefetch(self, request: dict):
+        """Start downloading the image of a message that is still waiting for a worker slot."""
+        image_url = request.get("image_url") if isinstance(request, dict) else None
+
+        if image_url and not image_url.lower().endswith(video_extensions):
+            self.downloader.prefetch(image_url)
 
-            image = self.models.preprocess(pil_image).unsqueeze(0).to(self.models.device)
+    async def close(self):
+        await self.embedding_batcher.close()
+        await self.downloader.close()
+        await self.face_detection_pool.close()
+
+    async def extract_image_embedding(self, pil_image: Image.Image) -> AppResponse:
+        try:
+            # Off the event loop: resizing is CPU work, and the first call may wait for the model to load
+            image = await asyncio.to_thread(self.models.preprocess_image, pil_image)
 
-            with torch.no_grad():
-                image_features = self.models.open_clip_model.encode_image(image)
+            image_features = await self.embedding_batcher.embed(image)
 
-            return SuccessResponse("Successfully generated embeddings from image", image_features.cpu().numpy().flatten())
+            return SuccessResponse("Successfully generated embeddings from image", image_features.flatten())
         
         except Exception as e:
-            logger.exception(f"Exception at ProcessImage extract_image_embedding_from_opencv")
-            return ServerErrorResponse(f"Exception at ProcessImage extract_image_embedding_from_opencv", e)        
+            logger.exception(f"Exception at ProcessImage extract_image_embedding")
+            return ServerErrorResponse(f"Exception at ProcessImage extract_image_embedding", e)
 
-    def detect_faces(self, rgb, queue):
+    async def extract_image_embedding_from_opencv(self, rgb_image) -> AppResponse:
+        return await self.extract_image_embedding(Image.fromarray(cv2.cvtColor(rgb_image, cv2.COLOR_BGR2RGB)))
+
+    async def upsert_image_vector(self, img_id: str, embedding: list, metadata: dict) -> AppResponse:
+        """Upsert the image vector, keeping the face_clusters entries clustering gave it.
+
+        An upsert replaces all metadata, so a reprocessed image would otherwise drop out of every user's
+        face-filtered searches. If a clustering sync wrote face_cluster_images between reading the entries
+        and the vector landing, the entries are read again and set once more.
+        """
         try:
-            boxes = face_recognition.face_locations(rgb, model="hog")
-            encodings = face_recognition.face_encodings(rgb, boxes)
-            queue.put((boxes, encodings))
+            # Taken before the read, so any cluster images write the read may have missed moves it
+            watermark = self.mongodb.cluster_images_watermark
+            face_clusters = (await self.mongodb.fetch_image_face_clusters([img_id]))[img_id]
+
+            if face_clusters:
+                metadata = {**metadata, FACE_CLUSTERS_FIELD: face_clusters}
+
+            upsert_result = await self.pinecone.upsert((img_id, embedding, metadata))
+
+            if not upsert_result.success:
+                return upsert_result
+
+            if watermark is not None and await self.mongodb.fetch_cluster_images_watermark(time.monotonic()) == watermark:
+                return upsert_result
+
+            current_face_clusters = (await self.mongodb.fetch_image_face_clusters([img_id]))[img_id]
+
+            if current_face_clusters != face_clusters:
+                return await self.pinecone.update_metadata({img_id: {FACE_CLUSTERS_FIELD: current_face_clusters}})
+
+            return upsert_result
         except Exception as e:
-            logger.exception(f"Exception at ProcessImage detect_faces")
-            queue.put(([], []))
-    
-    def run_with_timeout(self, rgb, timeout=30) -> AppResponse:
-        """Run face detection with a timeout"""
-        queue = Queue()
-        process = Process(target=self.detect_faces, args=(rgb, queue))
-        process.start()
-
-        process.join(timeout)
-
-        if not process.is_alive():
-            process.join()
-            if queue.empty():
-                return ErrorResponse("run_with_timeout failed", {
-                    "boxes": [],
-                    "encodings": []
-                })
-            values = queue.get()
-            return SuccessResponse("Successfully generated boxes and encodings", 
-                {
-                    "boxes": values[0],
-                    "encodings": values[1]
-                })
-
-        process.terminate()
-        process.join()
-        return SuccessResponse("Process timedout", {
-            "boxes": [],
-            "encodings": []
-        })
+            logger.exception(f"Exception at ProcessImage upsert_image_vector")
+            return ServerErrorResponse(f"Exception at ProcessImage upsert_image_vector", e)
 
     async def handle_request(self, request: dict)-> AppResponse:
         try:
@@ -93,22 +108,23 @@ class ProcessImage():
                 logger.exception("Not all required fields provided for processing image at ProcessImage handle_request", request)
                 return ErrorResponse("Not all required fields provided for processing image at ProcessImage handle_request", request)
 
-            response = requests.get(image_url)
-            response.raise_for_status()
+            download_result = await timed("download", self.downloader.download(image_url))
+
+            if not download_result.success:
+                return download_result
             
-            img = Image.open(BytesIO(response.content)).convert("RGB")
-            img_array = np.array(img)
-            rgb = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+            clip_view, face_frame = await timed("decode", asyncio.to_thread(decode_image, download_result.data))
 
-            image_embedding = await self.extract_image_embedding_from_opencv(rgb)
+            image_embedding = await timed("clip_embed", self.extract_image_embedding(clip_view))
 
             if not image_embedding.success:
                 logger.exception("Faield to generate image embeddings at ProcessImage handle_request", request)
                 return ErrorResponse("Faield to generate image embeddings at ProcessImage handle_request", request)
 
-            self.pinecone.index.upsert([(img_id, image_embedding.data.tolist(), {"experience_id": experience_id, "img_id": img_id, "image_url": image_url})])
+            # Written behind while faces are detected; awaited below so the message is only acked once it is stored
+            upsert_task = asyncio.create_task(timed("pinecone_upsert", self.upsert_image_vector(img_id, image_embedding.data.tolist(), {"experience_id": experience_id, "img_id": img_id, "image_url": image_url})))
 
-            run_with_timeout_result = self.run_with_timeout(rgb=rgb)
+            run_with_timeout_result = await timed("face_detect", self.face_detection_pool.detect(face_frame))
 
             if not run_with_timeout_result.success:
                 return run_with_timeout_result
@@ -124,7 +140,7 @@ class ProcessImage():
                 "faces":[
                     {
                         "bounding_box": box,
-                        "encoding": enc.tolist(),
+                        "encoding": encode_face_encoding(enc),
                         "face_id": None
                     }
                     for box, enc in zip(boxes, encodings)
@@ -132,10 +148,15 @@ class ProcessImage():
                 "created_at": datetime.datetime.now() 
             }
 
-            update_one_response = await self.mongodb.face_embeddings_collection.update_one({"_id": ObjectId(img_id)}, {"$set": update}, upsert=True)
+            update_one_response = await timed("mongo_write", self.mongodb.face_embeddings_writer.write(UpdateOne({"_id": ObjectId(img_id)}, {"$set": update}, upsert=True)))
+
+            if not update_one_response.success:
+                return ErrorResponse("Faield to update image embeddings to mongodb", update_one_response.error, update_one_response.data)
+
+            upsert_result = await upsert_task
 
-            if not update_one_response.acknowledged:
-                return ErrorResponse("Faield to update image embeddings to mongodb", update_one_response)
+            if not upsert_result.success:
+                return upsert_result
                 
             return SuccessResponse("Image processed again sucessfully", None)
         except Exception as e:
@@ -0,0 +1,88 @@
+import asyncio
+import os
+from dotenv import load_dotenv # type: ignore
+from loguru import logger # type: ignore
+from pymongo.errors import BulkWriteError
+from utils.response import AppResponse, ErrorResponse, ServerErrorResponse, SuccessResponse
+
+load_dotenv()
+
+MONGO_BULK_BATCH_SIZE = int(os.getenv("MONGO_BULK_BATCH_SIZE", "500"))
+MONGO_BULK_MAX_AGE_MS = float(os.getenv("MONGO_BULK_MAX_AGE_MS", "200"))
+
+class BulkWriter():
+    """Collects write operations for one collection and sends them as unordered bulk_write calls.
+
+    Each write() resolves with the outcome of its own operation, so a failed upsert is reported
+    back to the message that produced it rather than failing the whole batch.
+    """
+
+    def __init__(self, collection, batch_size: int = MONGO_BULK_BATCH_SIZE, max_age_ms: float = MONGO_BULK_MAX_AGE_MS):
+        self.collection = collection
+        self.batch_size = max(1, batch_size)
+        self.max_age = max(0.0, max_age_ms) / 1000
+        self.buffer = []
+        self.flush_task = None
+        self.batches = set()
+
+    async def write(self, operation) -> AppResponse:
+        """Queue a pymongo write model (UpdateOne, ReplaceOne, ...) and wait for its result."""
+        future = asyncio.get_running_loop().create_future()
+        self.buffer.append((operation, future))
+
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+        elif self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_after(self.max_age))
+
+        return await future
+
+    async def _flush_after(self, delay: float):
+        await asyncio.sleep(delay)
+        self.flush()
+
+    def flush(self):
+        while self.buffer:
+            batch = self.buffer[:self.batch_size]
+            del self.buffer[:self.batch_size]
+
+            task = asyncio.create_task(self._write_batch(batch))
+            self.batches.add(task)
+            task.add_done_callback(self.batches.discard)
+
+    async def _write_batch(self, batch: list):
+        operations = [operation for operation, _ in batch]
+        write_errors = {}
+        batch_error = None
+
+        try:
+            await self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            write_errors = {error["index"]: error for error in e.details.get("writeErrors", [])}
+            if e.details.get("writeConcernErrors"):
+                batch_error = e
+        except Exception as e:
+            logger.exception(f"Exception at BulkWriter _write_batch for {self.collection.name}")
+            batch_error = e
+
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+
+            if index in write_errors:
+                logger.error(f"Bulk write to {self.collection.name} failed for operation {index}: {write_errors[index].get('errmsg')}")
+                future.set_result(ErrorResponse(f"Bulk write to {self.collection.name} failed", data=write_errors[index]))
+            elif batch_error is not None:
+                future.set_result(ServerErrorResponse(f"Exception at BulkWriter _write_batch for {self.collection.name}", batch_error))
+            else:
+                future.set_result(SuccessResponse(f"Successfully wrote to {self.collection.name}", None))
+
+    async def close(self):
+        """Flush pending operations and wait for every in-flight batch."""
+        self.flush()
+
+        if self.batches:
+            await asyncio.gather(*self.batches, return_exceptions=True)
+
+        if self.flush_task and not self.flush_task.done():
+            self.flush_task.cancel()
@@ -0,0 +1,89 @@
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlsplit
+from dotenv import load_dotenv # type: ignore
+import httpx
+from loguru import logger # type: ignore
+from utils.response import AppResponse, ErrorResponse, ServerErrorResponse, SuccessResponse
+
+load_dotenv()
+
+DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", "5"))
+DOWNLOAD_READ_TIMEOUT = float(os.getenv("DOWNLOAD_READ_TIMEOUT", "30"))
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", "20"))
+DOWNLOAD_MAX_PER_HOST = int(os.getenv("DOWNLOAD_MAX_PER_HOST", "8"))
+DOWNLOAD_PREFETCH_LIMIT = int(os.getenv("DOWNLOAD_PREFETCH_LIMIT", "10"))
+
+class ImageDownloader():
+    """Shared async HTTP client for image downloads, with per-host limits, a size cap and prefetching."""
+
+    def __init__(self):
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(DOWNLOAD_READ_TIMEOUT, connect=DOWNLOAD_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=DOWNLOAD_MAX_CONNECTIONS, max_keepalive_connections=DOWNLOAD_MAX_CONNECTIONS),
+            follow_redirects=True,
+        )
+        self.host_semaphores: dict[str, asyncio.Semaphore] = {}
+        self.prefetched: OrderedDict[str, asyncio.Task] = OrderedDict()
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self.host_semaphores:
+            self.host_semaphores[host] = asyncio.Semaphore(DOWNLOAD_MAX_PER_HOST)
+        return self.host_semaphores[host]
+
+    async def _fetch(self, url: str) -> AppResponse:
+        try:
+            async with self._host_semaphore(url):
+                async with self.client.stream("GET", url) as response:
+                    response.raise_for_status()
+
+                    content_length = response.headers.get("content-length")
+                    if content_length and content_length.isdigit() and int(content_length) > DOWNLOAD_MAX_BYTES:
+                        return ErrorResponse(f"Image at {url} is {content_length} bytes, over the {DOWNLOAD_MAX_BYTES} byte limit")
+
+                    buffer = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        buffer.extend(chunk)
+                        if len(buffer) > DOWNLOAD_MAX_BYTES:
+                            return ErrorResponse(f"Image at {url} exceeded the {DOWNLOAD_MAX_BYTES} byte limit")
+
+            return SuccessResponse("Successfully downloaded image", bytes(buffer))
+
+        except httpx.HTTPStatusError as e:
+            logger.exception(f"HTTP error at ImageDownloader _fetch for {url}")
+            return ErrorResponse(f"HTTP {e.response.status_code} at ImageDownloader _fetch", e)
+        except Exception as e:
+            logger.exception(f"Exception at ImageDownloader _fetch for {url}")
+            return ServerErrorResponse(f"Exception at ImageDownloader _fetch", e)
+
+    def prefetch(self, url: Optional[str]):
+        """Start downloading an image that a later message will need. The oldest unclaimed prefetch is dropped when the buffer is full."""
+        if not url or url in self.prefetched or DOWNLOAD_PREFETCH_LIMIT <= 0:
+            return
+
+        while len(self.prefetched) >= DOWNLOAD_PREFETCH_LIMIT:
+            _, stale_task = self.prefetched.popitem(last=False)
+            stale_task.cancel()
+
+        self.prefetched[url] = asyncio.create_task(self._fetch(url))
+
+    async def download(self, url: str) -> AppResponse:
+        """Return the image bytes, reusing a prefetched download when there is one."""
+        task = self.prefetched.pop(url, None)
+
+        if task is not None:
+            return await task
+
+        return await self._fetch(url)
+
+    async def close(self):
+        for task in self.prefetched.values():
+            task.cancel()
+        await asyncio.gather(*self.prefetched.values(), return_exceptions=True)
+        self.prefetched.clear()
+
+        await self.client.aclose()
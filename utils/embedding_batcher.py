@@ -0,0 +1,121 @@
+import asyncio
+import os
+from collections import Counter
+from typing import Callable, Optional
+from dotenv import load_dotenv # type: ignore
+from loguru import logger # type: ignore
+import numpy as np
+import torch
+from utils.inference_executor import InferenceExecutor
+
+load_dotenv()
+
+CLIP_BATCH_SIZE = int(os.getenv("CLIP_BATCH_SIZE", "8"))
+CLIP_BATCH_MAX_WAIT_MS = float(os.getenv("CLIP_BATCH_MAX_WAIT_MS", "10"))
+CLIP_BATCH_STATS_EVERY = int(os.getenv("CLIP_BATCH_STATS_EVERY", "100"))
+# Tensors waiting for a batch; once full, embed() callers wait, which holds their message's worker slot
+CLIP_BATCH_QUEUE_SIZE = int(os.getenv("CLIP_BATCH_QUEUE_SIZE", "32"))
+
+class EmbeddingBatcher():
+    """Collects preprocessed tensors from concurrent callers and runs one encode call per stacked batch."""
+
+    def __init__(self, encode: Callable, device: str, inference: InferenceExecutor, max_batch_size: int = CLIP_BATCH_SIZE, max_wait_ms: float = CLIP_BATCH_MAX_WAIT_MS, max_queued: int = CLIP_BATCH_QUEUE_SIZE, name: str = "clip_image"):
+        self.encode = encode
+        self.device = device
+        self.inference = inference
+        self.max_queued = max(max_batch_size, max_queued)
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.name = name
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker_task: Optional[asyncio.Task] = None
+
+        self.batch_count = 0
+        self.item_count = 0
+        self.batch_sizes = Counter()
+
+    async def embed(self, tensor: torch.Tensor) -> np.ndarray:
+        """Queue one preprocessed tensor (no batch dimension) and wait for its embedding row."""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((tensor, future))
+        return await future
+
+    def _ensure_worker(self):
+        if self.worker_task is None or self.worker_task.done():
+            self.queue = asyncio.Queue(maxsize=self.max_queued)
+            self.worker_task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._run_batch(batch)
+
+    async def _run_batch(self, batch: list):
+        batch = [(tensor, future) for tensor, future in batch if not future.cancelled()]
+        if not batch:
+            return
+
+        try:
+            embeddings = await self.inference.run(self._encode_batch, [tensor for tensor, _ in batch])
+
+            for row, (_, future) in zip(embeddings, batch):
+                if not future.done():
+                    future.set_result(row)
+
+        except Exception as e:
+            logger.exception(f"Exception at EmbeddingBatcher _run_batch")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+        self._record(len(batch))
+
+    def _encode_batch(self, tensors: list) -> np.ndarray:
+        stacked = torch.stack(tensors).to(self.device)
+
+        with torch.no_grad():
+            features = self.encode(stacked)
+
+        return features.cpu().numpy()
+
+    def _record(self, size: int):
+        self.batch_count += 1
+        self.item_count += size
+        self.batch_sizes[size] += 1
+
+        if CLIP_BATCH_STATS_EVERY and self.batch_count % CLIP_BATCH_STATS_EVERY == 0:
+            logger.info(f"EmbeddingBatcher {self.name} stats: {self.stats()}")
+
+    def stats(self) -> dict:
+        average = self.item_count / self.batch_count if self.batch_count else 0.0
+        return {
+            "batches": self.batch_count,
+            "items": self.item_count,
+            "average_batch_size": round(average, 2),
+            "fill_ratio": round(average / self.max_batch_size, 3),
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+        }
+
+    async def close(self):
+        if self.worker_task and not self.worker_task.done():
+            self.worker_task.cancel()
+            await asyncio.gather(self.worker_task, return_exceptions=True)
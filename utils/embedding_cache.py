@@ -0,0 +1,164 @@
+import fcntl
+import json
+import os
+from collections import OrderedDict
+from typing import Optional
+from dotenv import load_dotenv # type: ignore
+from loguru import logger # type: ignore
+import numpy as np
+
+load_dotenv()
+
+TEXT_EMBEDDING_CACHE_SIZE = int(os.getenv("TEXT_EMBEDDING_CACHE_SIZE", "1024"))
+TEXT_EMBEDDING_CACHE_DIR = os.getenv("TEXT_EMBEDDING_CACHE_DIR")
+TEXT_EMBEDDING_CACHE_STATS_EVERY = int(os.getenv("TEXT_EMBEDDING_CACHE_STATS_EVERY", "100"))
+
+def normalize_prompt(text: str) -> str:
+    """Lowercase and collapse whitespace. The CLIP tokenizer does the same, so equal keys give equal tokens."""
+    return " ".join(str(text).lower().split())
+
+class _DiskTier():
+    """Append-only float32 vector file, memory-mapped for reads, with a JSON-lines key index."""
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.index_path = os.path.join(directory, "index.jsonl")
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.dim = None
+        self.rows = 0
+        self.index = {}
+        self.mmap = None
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as file:
+                self.dim = json.load(file)["dim"]
+            self._load_index()
+
+    def _load_index(self):
+        self.rows = os.path.getsize(self.vectors_path) // (self.dim * 4) if os.path.exists(self.vectors_path) else 0
+
+        if not os.path.exists(self.index_path):
+            return
+
+        with open(self.index_path) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                # Rows past the end of the vector file are from a write that never completed
+                if entry["row"] < self.rows:
+                    self.index[entry["key"]] = entry["row"]
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self.index.get(key)
+        if row is None:
+            return None
+
+        if self.mmap is None or row >= self.mmap.shape[0]:
+            self.mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+
+        return np.array(self.mmap[row])
+
+    def put(self, key: str, vector: np.ndarray):
+        vector = np.ascontiguousarray(vector, dtype=np.float32).ravel()
+
+        if self.dim is None:
+            self.dim = int(vector.shape[0])
+            with open(self.meta_path, "w") as file:
+                json.dump({"dim": self.dim}, file)
+
+        if vector.shape[0] != self.dim:
+            return
+
+        with open(self.index_path, "a") as index_file:
+            fcntl.flock(index_file, fcntl.LOCK_EX)
+            try:
+                # Another process may have appended since we loaded; take our row from the file itself
+                with open(self.vectors_path, "ab") as vectors_file:
+                    row = vectors_file.tell() // (self.dim * 4)
+                    vectors_file.write(vector.tobytes())
+                index_file.write(json.dumps({"key": key, "row": row}) + "\n")
+            finally:
+                fcntl.flock(index_file, fcntl.LOCK_UN)
+
+        self.rows = max(self.rows, row + 1)
+        self.index[key] = row
+
+class TextEmbeddingCache():
+    """Bounded LRU of prompt embeddings with an optional on-disk tier that survives restarts."""
+
+    def __init__(self, namespace: str, max_size: int = TEXT_EMBEDDING_CACHE_SIZE, directory: Optional[str] = TEXT_EMBEDDING_CACHE_DIR):
+        self.max_size = max(0, max_size)
+        self.entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.disk = None
+
+        if directory:
+            try:
+                self.disk = _DiskTier(os.path.join(directory, namespace))
+            except Exception:
+                logger.exception(f"Exception at TextEmbeddingCache __init__, disk tier disabled")
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = normalize_prompt(text)
+        vector = self.entries.get(key)
+
+        if vector is not None:
+            self.entries.move_to_end(key)
+            self.memory_hits += 1
+        elif self.disk is not None and (vector := self._disk_get(key)) is not None:
+            self._remember(key, vector)
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+
+        self._maybe_log()
+        return vector
+
+    def put(self, text: str, vector: np.ndarray):
+        key = normalize_prompt(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        self._remember(key, vector)
+
+        if self.disk is not None:
+            try:
+                self.disk.put(key, vector)
+            except Exception:
+                logger.exception(f"Exception at TextEmbeddingCache put")
+
+    def _disk_get(self, key: str) -> Optional[np.ndarray]:
+        try:
+            return self.disk.get(key)
+        except Exception:
+            logger.exception(f"Exception at TextEmbeddingCache _disk_get")
+            return None
+
+    def _remember(self, key: str, vector: np.ndarray):
+        if not self.max_size:
+            return
+
+        self.entries[key] = vector
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def _maybe_log(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        if TEXT_EMBEDDING_CACHE_STATS_EVERY and lookups % TEXT_EMBEDDING_CACHE_STATS_EVERY == 0:
+            logger.info(f"TextEmbeddingCache stats: {self.stats()}")
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "lookups": lookups,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            "size": len(self.entries),
+        }
@@ -0,0 +1,196 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from multiprocessing import shared_memory
+from typing import Optional
+from dotenv import load_dotenv # type: ignore
+from loguru import logger # type: ignore
+import numpy as np
+from utils.response import AppResponse, ErrorResponse, SuccessResponse
+
+load_dotenv()
+
+FACE_DETECTION_WORKERS = int(os.getenv("FACE_DETECTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+FACE_DETECTION_TIMEOUT = float(os.getenv("FACE_DETECTION_TIMEOUT", "30"))
+# Longest side, in pixels, of the copy HOG runs on. 0 detects on the full-resolution frame.
+FACE_DETECTION_MAX_SIDE = int(os.getenv("FACE_DETECTION_MAX_SIDE", "0"))
+
+def rescale_boxes(boxes: list, scale: float, shape: tuple) -> list:
+    """Map (top, right, bottom, left) boxes found on a frame resized by `scale` back onto a frame of `shape`."""
+    height, width = shape[:2]
+    return [
+        (
+            max(0, int(round(top / scale))),
+            min(width, int(round(right / scale))),
+            min(height, int(round(bottom / scale))),
+            max(0, int(round(left / scale))),
+        )
+        for top, right, bottom, left in boxes
+    ]
+
+def locate_faces(rgb: np.ndarray, max_side: int = 0) -> list:
+    """Run HOG on the frame, or on a copy downscaled to max_side, and return full-resolution boxes."""
+    import face_recognition
+
+    height, width = rgb.shape[:2]
+    longest = max(height, width)
+
+    if not max_side or longest <= max_side:
+        return face_recognition.face_locations(rgb, model="hog")
+
+    import cv2
+
+    scale = max_side / longest
+    small = cv2.resize(rgb, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+    boxes = face_recognition.face_locations(small, model="hog")
+    return rescale_boxes(boxes, scale, rgb.shape)
+
+def detect_faces(rgb: np.ndarray, max_side: int = 0) -> tuple[list, list]:
+    """Return (boxes, encodings) for every face found in the frame. Encodings always use full-resolution crops."""
+    import face_recognition
+
+    boxes = locate_faces(rgb, max_side)
+    encodings = face_recognition.face_encodings(rgb, boxes)
+    return boxes, encodings
+
+def _face_detection_worker(conn):
+    """Worker loop: attach to the shared frame named in each task, detect, send the result back.
+
+    Spawned workers share the parent's resource tracker, so the parent's unlink() balances the segment's
+    registration and the tracker still cleans it up if the parent dies.
+    """
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+
+        if task is None:
+            break
+
+        name, shape, dtype, max_side = task
+        shm = shared_memory.SharedMemory(name=name)
+
+        try:
+            frame = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+            result = detect_faces(frame, max_side)
+            del frame
+        except Exception:
+            logger.exception(f"Exception at face detection worker")
+            result = ([], [])
+        finally:
+            shm.close()
+
+        conn.send(result)
+
+class _Worker():
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_face_detection_worker, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        self.process.kill()
+        # Reaped off the calling thread, which is usually the event loop
+        threading.Thread(target=self.process.join, args=(5,), daemon=True).start()
+
+class FaceDetectionPool():
+    """Long-lived face-detection processes. Frames are passed through shared memory; hung workers are replaced."""
+
+    def __init__(self, size: int = FACE_DETECTION_WORKERS, timeout: float = FACE_DETECTION_TIMEOUT, max_side: int = FACE_DETECTION_MAX_SIDE):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.max_side = max(0, max_side)
+        self.context = multiprocessing.get_context("spawn")
+        self.workers: list[_Worker] = []
+        self.idle_workers: Optional[asyncio.Queue] = None
+
+    def _ensure_started(self):
+        if self.idle_workers is not None:
+            return
+
+        logger.info(f"Starting {self.size} face detection workers")
+        self.idle_workers = asyncio.Queue()
+        for _ in range(self.size):
+            worker = _Worker(self.context)
+            self.workers.append(worker)
+            self.idle_workers.put_nowait(worker)
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        worker.kill()
+        replacement = _Worker(self.context)
+        self.workers[self.workers.index(worker)] = replacement
+        return replacement
+
+    async def detect(self, frame: np.ndarray, timeout: Optional[float] = None) -> AppResponse:
+        """Run detect_faces on an idle worker. A worker that exceeds the timeout is killed and replaced."""
+        self._ensure_started()
+        timeout = self.timeout if timeout is None else timeout
+
+        worker = await self.idle_workers.get()
+        shm = None
+
+        try:
+            shm = shared_memory.SharedMemory(create=True, size=max(1, frame.nbytes))
+            shared_frame = np.ndarray(frame.shape, dtype=frame.dtype, buffer=shm.buf)
+            # Strided views (e.g. a BGR channel flip) are materialised here, straight into shared memory
+            shared_frame[...] = frame
+            del shared_frame
+
+            worker.conn.send((shm.name, frame.shape, frame.dtype.str, self.max_side))
+
+            ready = await asyncio.to_thread(worker.conn.poll, timeout)
+
+            if not ready:
+                logger.warning(f"Face detection exceeded {timeout}s, replacing worker")
+                worker = self._replace(worker)
+                return SuccessResponse("Process timedout", {
+                    "boxes": [],
+                    "encodings": []
+                })
+
+            boxes, encodings = worker.conn.recv()
+            return SuccessResponse("Successfully generated boxes and encodings", {
+                "boxes": boxes,
+                "encodings": encodings
+            })
+
+        except asyncio.CancelledError:
+            # The worker may still be busy with this frame; don't hand it to the next caller
+            worker = self._replace(worker)
+            raise
+
+        except (EOFError, BrokenPipeError, ConnectionResetError) as e:
+            logger.exception(f"Face detection worker died at FaceDetectionPool detect")
+            worker = self._replace(worker)
+            return ErrorResponse("run_with_timeout failed", e, {
+                "boxes": [],
+                "encodings": []
+            })
+
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            self.idle_workers.put_nowait(worker)
+
+    async def close(self):
+        for worker in self.workers:
+            try:
+                worker.conn.send(None)
+            except Exception:
+                pass
+
+        for worker in self.workers:
+            await asyncio.to_thread(worker.process.join, 5)
+            if worker.process.is_alive():
+                worker.kill()
+
+        self.workers = []
+        self.idle_workers = None
@@ -0,0 +1,76 @@
+import os
+from dotenv import load_dotenv # type: ignore
+from bson import Binary
+import numpy as np
+
+load_dotenv()
+
+# "list" stores encodings as BSON arrays of doubles; "binary" stores float32 bytes, about 3x smaller
+FACE_ENCODING_FORMAT = os.getenv("FACE_ENCODING_FORMAT", "list")
+
+def encode_face_encoding(encoding, encoding_format: str = FACE_ENCODING_FORMAT):
+    """Convert a face encoding into the value stored in face_embeddings."""
+    if encoding_format == "binary":
+        return Binary(np.asarray(encoding, dtype=np.float32).tobytes())
+    return np.asarray(encoding).tolist()
+
+def decode_face_encoding(value) -> np.ndarray:
+    """Read a stored encoding in either format. Binary values are viewed in place, without a copy."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return np.frombuffer(value, dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+class FaceEmbeddingMatrix():
+    """Face encodings in one growing float32 matrix plus a compact table pointing each row back to its image."""
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = max(1, capacity)
+        self.count = 0
+        self.matrix = None
+        self.boxes = np.empty((self.capacity, 4), dtype=np.int32)
+        self.face_images = np.empty(self.capacity, dtype=np.int32)
+        self.image_ids = []
+        self.image_urls = []
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def encodings(self) -> np.ndarray:
+        if self.matrix is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self.matrix[:self.count]
+
+    def add_image(self, img_id, image_url) -> int:
+        """Register an image, even one without faces, and return its index in the reference table."""
+        self.image_ids.append(img_id)
+        self.image_urls.append(image_url)
+        return len(self.image_ids) - 1
+
+    def add_face(self, image_index: int, encoding, bounding_box):
+        encoding = decode_face_encoding(encoding)
+
+        if self.matrix is None:
+            self.matrix = np.empty((self.capacity, len(encoding)), dtype=np.float32)
+        elif self.count == self.capacity:
+            self._grow()
+
+        self.matrix[self.count] = encoding
+        self.boxes[self.count] = bounding_box
+        self.face_images[self.count] = image_index
+        self.count += 1
+
+    def _grow(self):
+        self.capacity *= 2
+        self.matrix = np.resize(self.matrix, (self.capacity, self.matrix.shape[1]))
+        self.boxes = np.resize(self.boxes, (self.capacity, 4))
+        self.face_images = np.resize(self.face_images, self.capacity)
+
+    def member(self, row: int) -> dict:
+        """The {img_id, image_url, bounding_box} entry stored in cluster documents for this face."""
+        image_index = int(self.face_images[row])
+        return {
+            "img_id": self.image_ids[image_index],
+            "image_url": self.image_urls[image_index],
+            "bounding_box": self.boxes[row].tolist()
+        }
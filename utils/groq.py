@@ -1,19 +1,228 @@
+import asyncio
+import hashlib
 import json
 import os
+import random
+import re
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from typing import Optional
 from dotenv import load_dotenv # type: ignore
-from groq import Groq
+from groq import AsyncGroq, RateLimitError
+import httpx
+from loguru import logger # type: ignore
+from utils.metrics import span
 from utils.response import AppResponse, ServerErrorResponse, SuccessResponse
 
 load_dotenv()
 
+NAME_CACHE_SIZE = int(os.getenv("NAME_CACHE_SIZE", "512"))
+# Similarity at or above which a prompt word is taken to be a known name without asking the LLM
+NAME_FUZZY_MATCH_RATIO = float(os.getenv("NAME_FUZZY_MATCH_RATIO", "0.85"))
+# Between this and the match ratio a word might be a misspelt name, so the LLM decides
+NAME_FUZZY_AMBIGUOUS_RATIO = float(os.getenv("NAME_FUZZY_AMBIGUOUS_RATIO", "0.75"))
+
+GROQ_CONNECT_TIMEOUT = float(os.getenv("GROQ_CONNECT_TIMEOUT", "5"))
+GROQ_REQUEST_TIMEOUT = float(os.getenv("GROQ_REQUEST_TIMEOUT", "20"))
+# Concurrent requests this process may have open against the Groq rate limit
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "4"))
+GROQ_MAX_ATTEMPTS = int(os.getenv("GROQ_MAX_ATTEMPTS", "4"))
+GROQ_BACKOFF_BASE = float(os.getenv("GROQ_BACKOFF_BASE", "0.5"))
+GROQ_BACKOFF_MAX = float(os.getenv("GROQ_BACKOFF_MAX", "30"))
+
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+CURRENT_USER = "CURRENT_USER"
+SELF_REFERENCES = {"i", "me", "myself", "we", "us", "ourselves"}
+WORD_PATTERN = re.compile(r"[^\W\d_][\w'-]*")
+
+def known_names_fingerprint(known_names) -> str:
+    return hashlib.sha1(json.dumps(sorted(known_names or [])).encode()).hexdigest()
+
+def resolve_names_locally(known_names, query) -> Optional[list]:
+    """Find names in the prompt without the LLM.
+
+    Returns the user_names list when every word is either a known name (exact or a close fuzzy match),
+    a self-reference, or clearly not a name. Returns None when a word could be a name the LLM should judge.
+
+    Known names are only taken from capitalised words mid-sentence: "summer" or a sentence-initial
+    "Summer" may just be the word, so the LLM decides those.
+    """
+    query = str(query)
+    words = [(match.group(0), match.start()) for match in WORD_PATTERN.finditer(query)]
+    lowered = [word.lower() for word, _ in words]
+    known = [name for name in (known_names or []) if isinstance(name, str) and name.strip()]
+    names = []
+    claimed = set()
+
+    def sentence_start(offset: int) -> bool:
+        return offset == 0 or query[:offset].rstrip().endswith((".", "!", "?"))
+
+    def capitalised(index: int) -> bool:
+        word, offset = words[index]
+        return word[0].isupper() and not sentence_start(offset)
+
+    # Exact, case-insensitive matches, longest names first so "Mary Jane" wins over "Mary"
+    for name in sorted(known, key=lambda name: -len(name.split())):
+        name_words = name.lower().split()
+        for start in range(len(lowered) - len(name_words) + 1):
+            span = range(start, start + len(name_words))
+            if lowered[start:start + len(name_words)] == name_words and not claimed.intersection(span):
+                if not all(capitalised(index) for index in span):
+                    return None
+                claimed.update(span)
+                if name not in names:
+                    names.append(name)
+
+    known_words = {word: name for name in known for word in name.lower().split() if len(word) >= 3}
+
+    for index in range(len(words)):
+        if index in claimed:
+            continue
+
+        lower = lowered[index]
+        # All caps ("US", "ME") is more likely a country or state than a self-reference
+        if lower in SELF_REFERENCES and not (len(lower) > 1 and words[index][0].isupper()):
+            if CURRENT_USER not in names:
+                names.append(CURRENT_USER)
+            continue
+
+        best_ratio, best_name = 0.0, None
+        if len(lower) >= 3:
+            for known_word, name in known_words.items():
+                ratio = SequenceMatcher(None, lower, known_word).ratio()
+                if ratio > best_ratio:
+                    best_ratio, best_name = ratio, name
+
+        if best_ratio >= NAME_FUZZY_MATCH_RATIO and capitalised(index):
+            if best_name not in names:
+                names.append(best_name)
+        elif best_ratio >= NAME_FUZZY_AMBIGUOUS_RATIO:
+            return None
+        elif capitalised(index):
+            # A capitalised word mid-sentence may be a name we don't know
+            return None
+
+    return names
+
+def parse_duration(value: str) -> Optional[float]:
+    """Parse Groq's reset durations such as "7.66s", "2m59.56s" or "120ms" into seconds."""
+    parts = DURATION_PATTERN.findall(value or "")
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+def retry_delay(headers, attempt: int) -> float:
+    """Seconds to wait before retrying a 429, preferring the server's hints over exponential backoff."""
+    headers = headers or {}
+    delay = None
+
+    try:
+        if headers.get("retry-after-ms"):
+            delay = float(headers["retry-after-ms"]) / 1000
+        elif headers.get("retry-after"):
+            delay = float(headers["retry-after"])
+    except ValueError:
+        delay = None
+
+    if delay is None:
+        resets = [parse_duration(headers.get(name)) for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+        resets = [reset for reset in resets if reset is not None]
+        delay = max(resets) if resets else None
+
+    if delay is None:
+        delay = GROQ_BACKOFF_BASE * (2 ** attempt) * (1 + random.random())
+
+    return min(GROQ_BACKOFF_MAX, max(0.0, delay))
+
 class GroqApi():
 
     def __init__(self):
-        self.client = Groq()
+        self.client = AsyncGroq(
+            timeout=httpx.Timeout(GROQ_REQUEST_TIMEOUT, connect=GROQ_CONNECT_TIMEOUT),
+            max_retries=0,
+        )
+        self.semaphore = asyncio.Semaphore(max(1, GROQ_MAX_CONCURRENCY))
+        self.inflight_names: dict[tuple, asyncio.Task] = {}
+        self.names_cache: OrderedDict[tuple, dict] = OrderedDict()
+        self.local_name_hits = 0
+        self.cached_name_hits = 0
+        self.llm_name_calls = 0
+
+    def name_resolution_stats(self) -> dict:
+        return {
+            "local": self.local_name_hits,
+            "cached": self.cached_name_hits,
+            "llm": self.llm_name_calls,
+        }
+
+    async def create_completion(self, **kwargs):
+        """chat.completions.create under the concurrency limit, retrying 429s after the server's retry hint."""
+        for attempt in range(max(1, GROQ_MAX_ATTEMPTS)):
+            try:
+                async with self.semaphore:
+                    with span("groq"):
+                        return await self.client.chat.completions.create(**kwargs)
+            except RateLimitError as e:
+                if attempt + 1 >= GROQ_MAX_ATTEMPTS:
+                    raise
+
+                delay = retry_delay(e.response.headers if e.response is not None else None, attempt)
+                logger.warning(f"Groq rate limited, retrying in {delay:.2f}s (attempt {attempt + 1})")
+                await asyncio.sleep(delay)
+
+    async def identify_names_from_prompt(self, known_names, query) -> AppResponse:
+        """Resolve names locally or from the cache when possible; otherwise ask the LLM and cache its answer.
+
+        Identical prompts already waiting on the LLM share that one call.
+        """
+        try:
+            local_names = resolve_names_locally(known_names, query)
+
+            if local_names is not None:
+                self.local_name_hits += 1
+                logger.debug(f"Resolved names locally: {local_names} {self.name_resolution_stats()}")
+                return SuccessResponse("Successfully resolved names locally", {"user_names": local_names})
+
+            cache_key = (" ".join(str(query).lower().split()), known_names_fingerprint(known_names))
+
+            if cache_key in self.names_cache:
+                self.names_cache.move_to_end(cache_key)
+                self.cached_name_hits += 1
+                return SuccessResponse("Successfully made the llm call", self.names_cache[cache_key])
+
+        except Exception as e:
+            logger.exception(f"Exception at GroqApi identify_names_from_prompt local pass")
+            cache_key = None
+
+        if cache_key is not None and cache_key in self.inflight_names:
+            self.cached_name_hits += 1
+            return await asyncio.shield(self.inflight_names[cache_key])
+
+        task = asyncio.create_task(self._identify_names_and_cache(known_names, query, cache_key))
+
+        if cache_key is not None:
+            self.inflight_names[cache_key] = task
+            task.add_done_callback(lambda _: self.inflight_names.pop(cache_key, None))
+
+        # Shielded so one caller being cancelled doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+    async def _identify_names_and_cache(self, known_names, query, cache_key) -> AppResponse:
+        self.llm_name_calls += 1
+        response = await self.identify_names_from_prompt_with_llm(known_names, query)
+
+        if response.success and cache_key is not None and NAME_CACHE_SIZE > 0:
+            self.names_cache[cache_key] = response.data
+            while len(self.names_cache) > NAME_CACHE_SIZE:
+                self.names_cache.popitem(last=False)
+
+        return response
 
-    def call_llm(self) -> AppResponse:
+    async def call_llm(self) -> AppResponse:
         try:
-            completion = self.client.chat.completions.create(
+            completion = await self.create_completion(
                 model="llama-3.3-70b-versatile",
                 messages=[],
                 temperature=1,
@@ -30,9 +239,9 @@ class GroqApi():
             print("Failed to make the llm call", e)
             return ServerErrorResponse("Failed to make the llm call", e)
         
-    def identify_names_from_prompt(self, known_names, query) -> AppResponse:
+    async def identify_names_from_prompt_with_llm(self, known_names, query) -> AppResponse:
         try:
-            completion = self.client.chat.completions.create(
+            completion = await self.create_completion(
                 model="llama-3.1-8b-instant",
                 messages=[
                     {
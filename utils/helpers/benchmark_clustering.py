@@ -0,0 +1,55 @@
+import argparse
+import sys
+import os
+import time
+import tracemalloc
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+from utils.clustering import CLUSTER_EPS, CLUSTER_MIN_SAMPLES, cluster_faces
+
+def synthetic_faces(count: int, people: int, spread: float, seed: int = 0) -> np.ndarray:
+    """Unit-norm 128-d identity centers with gaussian jitter, roughly the shape of face_recognition encodings."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(people, 128))
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    faces = centers[rng.integers(0, people, count)] + rng.normal(scale=spread, size=(count, 128))
+    return faces.astype(np.float32)
+
+def measure(encodings: np.ndarray, engine: str, eps: float, min_samples: int):
+    """Time one run, then trace memory on a second run, since tracemalloc slows allocations down."""
+    start = time.perf_counter()
+    labels = cluster_faces(encodings, eps=eps, min_samples=min_samples, engine=engine)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    cluster_faces(encodings, eps=eps, min_samples=min_samples, engine=engine)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return labels, seconds, peak
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time and peak memory of the clustering engines against face count")
+    parser.add_argument("--counts", type=int, nargs="+", default=[1000, 5000, 10000, 20000, 40000])
+    parser.add_argument("--engines", nargs="+", default=["dbscan", "tree", "blocked"])
+    parser.add_argument("--people", type=int, default=200)
+    parser.add_argument("--spread", type=float, default=0.03)
+    parser.add_argument("--eps", type=float, default=CLUSTER_EPS)
+    parser.add_argument("--min-samples", type=int, default=CLUSTER_MIN_SAMPLES)
+    args = parser.parse_args()
+
+    print(f"{'faces':>8} {'engine':>8} {'seconds':>9} {'peak MiB':>9} {'clusters':>9} {'ARI vs first':>13}")
+
+    for count in args.counts:
+        encodings = synthetic_faces(count, args.people, args.spread)
+        reference = None
+
+        for engine in args.engines:
+            labels, seconds, peak = measure(encodings, engine, args.eps, args.min_samples)
+            reference = labels if reference is None else reference
+            clusters = len(set(labels.tolist()) - {-1})
+            agreement = adjusted_rand_score(reference, labels)
+            print(f"{count:>8} {engine:>8} {seconds:>9.2f} {peak / 2**20:>9.1f} {clusters:>9} {agreement:>13.4f}")
@@ -0,0 +1,58 @@
+import argparse
+import sys
+import os
+import time
+import tracemalloc
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from io import BytesIO
+import cv2
+import numpy as np
+from PIL import Image
+from utils.image_ingest import decode_image
+
+def previous_ingest(data: bytes):
+    """The ingest path ProcessImage used before decode_image: full decode, BGR copy, then back to RGB for CLIP."""
+    img = Image.open(BytesIO(data)).convert("RGB")
+    bgr = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+    clip_view = Image.fromarray(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB))
+    return clip_view, bgr
+
+def current_ingest(data: bytes):
+    clip_view, face_frame = decode_image(data)
+    # The face pool copies the frame into shared memory; count that copy here too
+    return clip_view, np.ascontiguousarray(face_frame)
+
+def measure(function, data: bytes, repeat: int):
+    seconds = []
+    peak = 0
+
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        function(data)
+        seconds.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return float(np.median(seconds)), peak
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare decode time and peak memory of the image ingest paths")
+    parser.add_argument("paths", nargs="+", help="Image files")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for path in args.paths:
+        with open(path, "rb") as file:
+            data = file.read()
+
+        before_seconds, before_peak = measure(previous_ingest, data, args.repeat)
+        after_seconds, after_peak = measure(current_ingest, data, args.repeat)
+
+        print(
+            f"{os.path.basename(path)}: "
+            f"previous {before_seconds * 1000:.1f}ms {before_peak / 2**20:.1f}MiB | "
+            f"decode_image {after_seconds * 1000:.1f}ms {after_peak / 2**20:.1f}MiB"
+        )
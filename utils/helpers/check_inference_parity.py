@@ -0,0 +1,99 @@
+import argparse
+import gc
+import sys
+import os
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+import numpy as np
+import torch
+from utils.image_ingest import decode_image
+from utils.models import IMAGE_TOWER, TEXT_TOWER, Models
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+DEFAULT_PROMPTS = [
+    "happy images",
+    "beach sunset with friends",
+    "birthday party",
+    "people hiking in the mountains",
+    "a dog playing in the snow",
+    "wedding ceremony",
+]
+
+def load_image_tensors(directory: str, preprocess) -> torch.Tensor:
+    """Preprocess every image once, through the same decode path as ingest.
+
+    The preprocess transform includes a random crop, so every precision must see the exact same tensors.
+    """
+    tensors = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(directory, name), "rb") as file:
+                clip_view, _ = decode_image(file.read())
+            tensors.append(preprocess(clip_view))
+    return torch.stack(tensors)
+
+def embed(models: Models, images: torch.Tensor, tokens: torch.Tensor, batch_size: int):
+    image_embeddings = []
+    start = time.perf_counter()
+    for offset in range(0, len(images), batch_size):
+        image_embeddings.append(models.encode_image(images[offset:offset + batch_size].to(models.device)).cpu().numpy())
+    image_seconds = (time.perf_counter() - start) / len(images)
+
+    start = time.perf_counter()
+    text_embeddings = models.encode_text(tokens.to(models.device)).cpu().numpy()
+    text_seconds = (time.perf_counter() - start) / len(tokens)
+
+    return np.concatenate(image_embeddings), text_embeddings, image_seconds, text_seconds
+
+def cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+def top1_agreement(reference_images, reference_texts, texts) -> float:
+    """Share of prompts whose best-matching image stays the same, the retrieval question Pinecone answers."""
+    def best(image_embeddings, text_embeddings):
+        image_embeddings = image_embeddings / np.linalg.norm(image_embeddings, axis=1, keepdims=True)
+        text_embeddings = text_embeddings / np.linalg.norm(text_embeddings, axis=1, keepdims=True)
+        return np.argmax(text_embeddings @ image_embeddings.T, axis=1)
+
+    # New queries are matched against the fp32 vectors already stored in Pinecone
+    return float(np.mean(best(reference_images, reference_texts) == best(reference_images, texts)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedding drift and speed of reduced-precision CLIP inference against the fp32 baseline")
+    parser.add_argument("images", help="Directory with the fixed image set")
+    parser.add_argument("--precisions", nargs="+", default=["int8", "bf16"])
+    parser.add_argument("--prompts", nargs="+", default=DEFAULT_PROMPTS)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="Fail when any image or prompt embedding drifts below this")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    baseline = Models(towers=(IMAGE_TOWER, TEXT_TOWER), precision="fp32")
+    images = load_image_tensors(args.images, baseline.preprocess)
+    tokens = baseline.tokenizer(args.prompts)
+    reference_images, reference_texts, image_seconds, text_seconds = embed(baseline, images, tokens, args.batch_size)
+    del baseline
+    gc.collect()
+
+    print(f"{len(images)} images, {len(tokens)} prompts")
+    print(f"{'precision':>9} {'ms/image':>9} {'ms/prompt':>10} {'min cos img':>12} {'mean cos img':>13} {'min cos txt':>12} {'top1 agree':>11}")
+    print(f"{'fp32':>9} {image_seconds * 1000:>9.1f} {text_seconds * 1000:>10.1f} {1:>12.5f} {1:>13.5f} {1:>12.5f} {1:>11.3f}")
+
+    failed = False
+    for precision in args.precisions:
+        models = Models(towers=(IMAGE_TOWER, TEXT_TOWER), precision=precision)
+        image_embeddings, text_embeddings, image_seconds, text_seconds = embed(models, images, tokens, args.batch_size)
+        del models
+        gc.collect()
+
+        image_cosines = cosine(reference_images, image_embeddings)
+        text_cosines = cosine(reference_texts, text_embeddings)
+        agreement = top1_agreement(reference_images, reference_texts, text_embeddings)
+        failed |= min(image_cosines.min(), text_cosines.min()) < args.min_cosine
+
+        print(f"{precision:>9} {image_seconds * 1000:>9.1f} {text_seconds * 1000:>10.1f} {image_cosines.min():>12.5f} {image_cosines.mean():>13.5f} {text_cosines.min():>12.5f} {agreement:>11.3f}")
+
+    sys.exit(1 if failed else 0)
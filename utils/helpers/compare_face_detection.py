@@ -0,0 +1,98 @@
+import argparse
+import sys
+import os
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+import numpy as np
+from utils.face_detection import detect_faces
+from utils.image_ingest import decode_image
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+def box_iou(a, b) -> float:
+    top, right, bottom, left = max(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+    intersection = max(0, right - left) * max(0, bottom - top)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    union = area_a + area_b - intersection
+    return intersection / union if union else 0.0
+
+def match_faces(reference_boxes, reference_encodings, boxes, encodings, min_iou=0.5):
+    """Greedily pair each reference face with the best-overlapping candidate face."""
+    matched = 0
+    distances = []
+    used = set()
+
+    for ref_box, ref_enc in zip(reference_boxes, reference_encodings):
+        best_index, best_iou = None, min_iou
+        for index, box in enumerate(boxes):
+            iou = box_iou(ref_box, box)
+            if index not in used and iou >= best_iou:
+                best_index, best_iou = index, iou
+
+        if best_index is not None:
+            used.add(best_index)
+            matched += 1
+            distances.append(float(np.linalg.norm(ref_enc - encodings[best_index])))
+
+    return matched, distances
+
+def collect_images(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+def compare(paths, max_side: int):
+    full_seconds, scaled_seconds = [], []
+    reference_faces = scaled_faces = matched_faces = 0
+    distances = []
+
+    for path in collect_images(paths):
+        # The frame production detects on: decode_image's color order, materialised like the pool's shared-memory copy
+        with open(path, "rb") as file:
+            _, face_frame = decode_image(file.read())
+        frame = np.ascontiguousarray(face_frame)
+
+        start = time.perf_counter()
+        ref_boxes, ref_encodings = detect_faces(frame)
+        full_seconds.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        boxes, encodings = detect_faces(frame, max_side)
+        scaled_seconds.append(time.perf_counter() - start)
+
+        matched, image_distances = match_faces(ref_boxes, ref_encodings, boxes, encodings)
+        reference_faces += len(ref_boxes)
+        scaled_faces += len(boxes)
+        matched_faces += matched
+        distances.extend(image_distances)
+
+        print(f"{os.path.basename(path)} {frame.shape[1]}x{frame.shape[0]}: full {len(ref_boxes)} faces {full_seconds[-1]:.2f}s | max_side={max_side} {len(boxes)} faces {scaled_seconds[-1]:.2f}s")
+
+    if not full_seconds:
+        print("No images found")
+        return
+
+    print("")
+    print(f"images: {len(full_seconds)}")
+    print(f"latency full:   mean {np.mean(full_seconds):.3f}s p95 {np.percentile(full_seconds, 95):.3f}s")
+    print(f"latency scaled: mean {np.mean(scaled_seconds):.3f}s p95 {np.percentile(scaled_seconds, 95):.3f}s")
+    print(f"faces full: {reference_faces} scaled: {scaled_faces} matched (IoU >= 0.5): {matched_faces}")
+    print(f"recall vs full: {matched_faces / reference_faces if reference_faces else 1.0:.3f}")
+    if distances:
+        # face_recognition treats distances under 0.6 as the same person
+        print(f"encoding distance of matched faces: mean {np.mean(distances):.4f} max {np.max(distances):.4f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare full-resolution and downscaled face detection")
+    parser.add_argument("paths", nargs="+", help="Image files or directories")
+    parser.add_argument("--max-side", type=int, default=1600)
+    args = parser.parse_args()
+
+    compare(args.paths, args.max_side)
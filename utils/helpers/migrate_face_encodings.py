@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import sys
+import os
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from loguru import logger # type: ignore
+from pymongo import UpdateOne
+from utils.face_embeddings import encode_face_encoding
+from utils.mongodb import MongodbDatabase
+
+# Documents with at least one face whose encoding is still a list of doubles
+LIST_ENCODING_FILTER = {"faces.encoding.0": {"$exists": True}}
+
+def convert_faces(faces: list) -> list:
+    return [
+        {**face, "encoding": encode_face_encoding(face["encoding"], "binary")} if isinstance(face.get("encoding"), list) else face
+        for face in faces
+    ]
+
+async def migrate_face_encodings(batch_size: int, pause: float, dry_run: bool):
+    """Rewrite list encodings in face_embeddings as float32 binary, one unordered bulk_write per batch.
+
+    Each update is guarded on created_at, so a document re-processed while the migration runs is
+    left alone instead of being overwritten with its old faces.
+    """
+    mongodb_database = MongodbDatabase()
+    collection = mongodb_database.face_embeddings_collection
+
+    remaining = await collection.count_documents(LIST_ENCODING_FILTER)
+    logger.info(f"{remaining} face_embeddings documents still store list encodings")
+
+    if dry_run or not remaining:
+        return
+
+    migrated = 0
+    last_id = None
+
+    while True:
+        query = dict(LIST_ENCODING_FILTER)
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+
+        documents = await collection.find(query, {"faces": 1, "created_at": 1}).sort("_id", 1).limit(batch_size).to_list(length=None)
+        if not documents:
+            break
+
+        operations = [
+            UpdateOne({"_id": document["_id"], "created_at": document.get("created_at")}, {"$set": {"faces": convert_faces(document["faces"])}})
+            for document in documents
+        ]
+
+        try:
+            result = await collection.bulk_write(operations, ordered=False)
+            migrated += result.modified_count
+        except Exception:
+            logger.exception(f"Exception at migrate_face_encodings for batch ending at {documents[-1]['_id']}")
+
+        last_id = documents[-1]["_id"]
+        logger.info(f"Migrated {migrated} / {remaining} documents")
+
+        if pause:
+            await asyncio.sleep(pause)
+
+    logger.info(f"Done, migrated {migrated} documents")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert stored face encodings from BSON double arrays to float32 binary")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.1, help="Seconds to sleep between batches to limit load on the cluster")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the documents that still need converting")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    asyncio.run(migrate_face_encodings(args.batch_size, args.pause, args.dry_run))
+    logger.info(f"Took {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,33 @@
+import os
+from io import BytesIO
+from dotenv import load_dotenv # type: ignore
+import numpy as np
+from PIL import Image
+
+load_dotenv()
+
+# CLIP preprocess resizes to 224px; the CLIP view is box-reduced to no less than twice that before it gets there
+INGEST_CLIP_MIN_SIDE = int(os.getenv("INGEST_CLIP_MIN_SIDE", "448"))
+# Stored face encodings were computed on BGR frames; keep feeding BGR so new encodings stay comparable
+FACE_DETECTION_COLOR_ORDER = os.getenv("FACE_DETECTION_COLOR_ORDER", "bgr").lower()
+
+def decode_image(data: bytes, clip_min_side: int = INGEST_CLIP_MIN_SIDE) -> tuple[Image.Image, np.ndarray]:
+    """Decode an upload once and return (clip_view, face_frame).
+
+    clip_view is a small RGB PIL image for CLIP preprocess. face_frame is the full-resolution HxWx3 uint8
+    array in FACE_DETECTION_COLOR_ORDER that encodings are computed on; the BGR layout is a reversed-channel
+    view, not a copy. Detection downscales its own copy (FACE_DETECTION_MAX_SIDE) and maps boxes back.
+    """
+    img = Image.open(BytesIO(data))
+
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    face_frame = np.asarray(img)
+    if FACE_DETECTION_COLOR_ORDER == "bgr":
+        face_frame = face_frame[..., ::-1]
+
+    factor = min(img.size) // clip_min_side if clip_min_side else 0
+    clip_view = img.reduce(factor) if factor > 1 else img
+
+    return clip_view, face_frame
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from dotenv import load_dotenv # type: ignore
+from loguru import logger # type: ignore
+import numpy as np
+
+load_dotenv()
+
+# torch intra-op threads for one forward pass; 0 keeps torch's default (one per core)
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0"))
+INFERENCE_INTEROP_THREADS = int(os.getenv("INFERENCE_INTEROP_THREADS", "0"))
+# Calls queued or running at once; further callers wait, which holds their message's worker slot
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "4"))
+INFERENCE_STATS_EVERY = int(os.getenv("INFERENCE_STATS_EVERY", "100"))
+INFERENCE_STATS_WINDOW = 1000
+
+def _configure_torch(threads: int, interop_threads: int):
+    import torch
+
+    if threads:
+        torch.set_num_threads(threads)
+
+    if interop_threads:
+        try:
+            torch.set_interop_threads(interop_threads)
+        except RuntimeError:
+            # Only allowed before the first inter-op parallel call in the process
+            logger.warning(f"Could not set torch interop threads to {interop_threads}, already initialized")
+
+    logger.info(f"Inference thread using {torch.get_num_threads()} torch threads, {torch.get_num_interop_threads()} interop threads")
+
+class InferenceExecutor():
+    """Runs every model forward pass on one dedicated thread, off the event loop.
+
+    One pass at a time already uses all the torch threads, so a single worker avoids oversubscribing
+    the cores. Submissions beyond queue_size wait on the event loop, pushing back on the callers.
+    """
+
+    def __init__(self, queue_size: int = INFERENCE_QUEUE_SIZE, threads: int = INFERENCE_THREADS, interop_threads: int = INFERENCE_INTEROP_THREADS, name: str = "inference"):
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name, initializer=_configure_torch, initargs=(threads, interop_threads))
+        self.slots = asyncio.Semaphore(max(1, queue_size))
+        self.calls = 0
+        self.waits = deque(maxlen=INFERENCE_STATS_WINDOW)
+        self.computes = deque(maxlen=INFERENCE_STATS_WINDOW)
+
+    async def run(self, function: Callable, *args, record: bool = True):
+        """Run function(*args) on the inference thread and return its result. record=False leaves it out of the stats, e.g. for model loading."""
+        submitted_at = time.perf_counter()
+        async with self.slots:
+            result, started_at, finished_at = await asyncio.get_running_loop().run_in_executor(self.executor, self._timed, function, args)
+
+        if record:
+            self._record(started_at - submitted_at, finished_at - started_at)
+        return result
+
+    @staticmethod
+    def _timed(function: Callable, args: tuple):
+        started_at = time.perf_counter()
+        result = function(*args)
+        return result, started_at, time.perf_counter()
+
+    def _record(self, wait: float, compute: float):
+        self.calls += 1
+        self.waits.append(wait * 1000)
+        self.computes.append(compute * 1000)
+
+        if INFERENCE_STATS_EVERY and self.calls % INFERENCE_STATS_EVERY == 0:
+            logger.info(f"InferenceExecutor {self.name} stats: {self.stats()}")
+
+    def stats(self) -> dict:
+        """Queue wait (submission to start on the inference thread) and compute time, in ms over recent calls."""
+        def summary(values):
+            if not values:
+                return {}
+            values = np.fromiter(values, dtype=np.float64)
+            return {
+                "mean": round(float(values.mean()), 1),
+                "p50": round(float(np.percentile(values, 50)), 1),
+                "p95": round(float(np.percentile(values, 95)), 1),
+            }
+
+        return {
+            "calls": self.calls,
+            "queue_wait_ms": summary(self.waits),
+            "compute_ms": summary(self.computes),
+        }
+
+    async def close(self):
+        await asyncio.to_thread(self.executor.shutdown, True)
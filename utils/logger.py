@@ -1,4 +1,8 @@
+import atexit
 import os
+import queue
+import threading
+import time
 from loguru import logger
 import sys
 import boto3
@@ -12,76 +16,161 @@ AWS_LOG_STREAM_NAME = os.getenv("AWS_LOG_STREAM_NAME")
 TIMESTAMP = int(datetime.datetime.utcnow().timestamp() * 1000)
 LOG_STREAM_NAME = f"{AWS_LOG_STREAM_NAME}{TIMESTAMP}"
 
+# PutLogEvents limits: 10,000 events and 1 MiB per call, counting 26 bytes of overhead per event
+CLOUDWATCH_MAX_BATCH_EVENTS = 10000
+CLOUDWATCH_MAX_BATCH_BYTES = 1024 * 1024
+CLOUDWATCH_EVENT_OVERHEAD_BYTES = 26
+CLOUDWATCH_MAX_EVENT_BYTES = 256 * 1024 - CLOUDWATCH_EVENT_OVERHEAD_BYTES
+# Room kept free in every batch for the drop report _send may append, which is well under this
+CLOUDWATCH_DROP_REPORT_BYTES = 256
+
+CLOUDWATCH_FLUSH_INTERVAL = float(os.getenv("CLOUDWATCH_FLUSH_INTERVAL", "5"))
+CLOUDWATCH_QUEUE_SIZE = int(os.getenv("CLOUDWATCH_QUEUE_SIZE", "20000"))
+# Past this share of the queue, DEBUG lines are dropped so the rest still fits
+CLOUDWATCH_DEBUG_DROP_FILL = float(os.getenv("CLOUDWATCH_DEBUG_DROP_FILL", "0.5"))
+CLOUDWATCH_MAX_ATTEMPTS = int(os.getenv("CLOUDWATCH_MAX_ATTEMPTS", "3"))
+CLOUDWATCH_SHUTDOWN_TIMEOUT = float(os.getenv("CLOUDWATCH_SHUTDOWN_TIMEOUT", "10"))
+
+client = None
+
 if ENV == "PRODUCTION":
     try:
         client = boto3.client("logs", region_name=AWS_REGION)
     except Exception as e:
-        logger.critical(f"Failed to initialize AWS CloudWatch client: {e}")
-        sys.exit(1)
+        logger.critical(f"Failed to initialize AWS CloudWatch client, logging to stdout only: {e}")
 
+if client is not None:
     try:
         client.create_log_group(logGroupName=AWS_LOG_GROUP_NAME)
     except client.exceptions.ResourceAlreadyExistsException:
         pass
     except Exception as e:
-        logger.critical(f"Failed to create log group: {e}")
-        sys.exit(1)
+        logger.critical(f"Failed to create log group, logging to stdout only: {e}")
+        client = None
 
+if client is not None:
     try:
         client.create_log_stream(logGroupName=AWS_LOG_GROUP_NAME, logStreamName=LOG_STREAM_NAME)
     except client.exceptions.ResourceAlreadyExistsException:
         pass
     except Exception as e:
-        logger.critical(f"Failed to create log stream: {e}")
-        sys.exit(1)
+        logger.critical(f"Failed to create log stream, logging to stdout only: {e}")
+        client = None
 
-    sequence_token = None
+def event_bytes(event: dict) -> int:
+    return len(event["message"].encode("utf-8")) + CLOUDWATCH_EVENT_OVERHEAD_BYTES
 
-def send_to_cloudwatch(message, retry=True):
-    """Send logs to AWS CloudWatch, failing the app if logging is unavailable."""
-    global sequence_token
+class CloudWatchSink:
+    """Loguru sink that buffers log lines and ships them to CloudWatch in batches from a background thread.
+
+    write() never blocks on the network. When the buffer backs up, DEBUG lines are dropped first and
+    everything is dropped once it is full; the drops are counted and reported in the next batch.
+    """
+
+    def __init__(self, flush_interval: float = CLOUDWATCH_FLUSH_INTERVAL, queue_size: int = CLOUDWATCH_QUEUE_SIZE):
+        self.flush_interval = flush_interval
+        self.queue_size = max(1, queue_size)
+        self.events = queue.Queue(maxsize=self.queue_size)
+        self.debug_drop_size = int(self.queue_size * CLOUDWATCH_DEBUG_DROP_FILL)
+        self.dropped_debug = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="cloudwatch-logs", daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
 
-    log_event = {
-        "logGroupName": AWS_LOG_GROUP_NAME,
-        "logStreamName": LOG_STREAM_NAME,
-        "logEvents": [
-            {
-                "timestamp": int(datetime.datetime.utcnow().timestamp() * 1000),
-                "message": message.strip()
-            }
-        ]
-    }
+    def write(self, message):
+        record = message.record
+        event = {
+            "timestamp": int(record["time"].timestamp() * 1000),
+            # Embedded metric format lines must be bare JSON for CloudWatch to extract the metrics
+            "message": record["message"] if record["extra"].get("emf") else message.strip()
+        }
+
+        if len(event["message"].encode("utf-8")) > CLOUDWATCH_MAX_EVENT_BYTES:
+            event["message"] = event["message"].encode("utf-8")[:CLOUDWATCH_MAX_EVENT_BYTES].decode("utf-8", "ignore")
+
+        if record["level"].no <= 10 and self.events.qsize() >= self.debug_drop_size:
+            self.dropped_debug += 1
+            return
 
-    if sequence_token:
-        log_event["sequenceToken"] = sequence_token
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        batch = []
+        batch_bytes = 0
+        deadline = time.monotonic() + self.flush_interval
+
+        while not (self.stopping.is_set() and self.events.empty()):
+            try:
+                event = self.events.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                event = None
+
+            if event is not None:
+                size = event_bytes(event)
+                if len(batch) >= CLOUDWATCH_MAX_BATCH_EVENTS - 1 or batch_bytes + size > CLOUDWATCH_MAX_BATCH_BYTES - CLOUDWATCH_DROP_REPORT_BYTES:
+                    self._send(batch)
+                    batch, batch_bytes = [], 0
+                batch.append(event)
+                batch_bytes += size
+
+            if time.monotonic() >= deadline or (self.stopping.is_set() and self.events.empty()):
+                self._send(batch)
+                batch, batch_bytes = [], 0
+                deadline = time.monotonic() + self.flush_interval
+
+        self._send(batch)
+
+    def _send(self, batch: list):
+        drop_report = self._drop_report()
+        if drop_report:
+            batch = batch + [drop_report]
+
+        if not batch:
+            return
 
-    try:
-        response = client.put_log_events(**log_event)
-        sequence_token = response.get("nextSequenceToken")
+        # A batch must be in chronological order; lines from different threads can arrive slightly out of it
+        batch.sort(key=lambda event: event["timestamp"])
 
-    except client.exceptions.InvalidSequenceTokenException as e:
-        if retry:
-            sequence_token = e.response["expectedSequenceToken"]
-            send_to_cloudwatch(message, retry=False)  # Retry with updated token
-        else:
-            logger.critical("CloudWatch sequence token error, logging permanently failed.")
-            sys.exit(1)  # Stop the application
+        for attempt in range(CLOUDWATCH_MAX_ATTEMPTS):
+            try:
+                client.put_log_events(logGroupName=AWS_LOG_GROUP_NAME, logStreamName=LOG_STREAM_NAME, logEvents=batch)
+                return
+            except Exception as e:
+                error = e
+                if attempt + 1 < CLOUDWATCH_MAX_ATTEMPTS:
+                    time.sleep(min(2 ** attempt, 5))
 
-    except Exception as e:
-        logger.critical(f"Failed to send logs to CloudWatch: {e}")
-        sys.exit(1)  # Stop the application
+        self.failed_batches += 1
+        print(f"Failed to send {len(batch)} log events to CloudWatch, dropped them: {error}", file=sys.stderr)
 
-class CloudWatchSink:
-    """Custom Loguru Sink to send logs to AWS CloudWatch. Fails the app if logging fails."""
+    def _drop_report(self):
+        dropped_debug, self.dropped_debug = self.dropped_debug, 0
+        dropped, self.dropped = self.dropped, 0
 
-    def write(self, message):
-        send_to_cloudwatch(message)
+        if not dropped_debug and not dropped:
+            return None
+
+        return {
+            "timestamp": int(time.time() * 1000),
+            "message": f"CloudWatchSink dropped {dropped_debug} DEBUG and {dropped} other log lines under backpressure"
+        }
+
+    def stop(self):
+        """Flush what is buffered before the process exits."""
+        self.stopping.set()
+        self.thread.join(CLOUDWATCH_SHUTDOWN_TIMEOUT)
 
 logger.remove()
 logger.add(sys.stdout, level="DEBUG")
 # logger.add(sys.stdout, format="{time} {level} {message}", level="DEBUG")
 # logger.add("logs/app.log", rotation="1 MB", retention="10 days", level="DEBUG")
-if ENV == "PRODUCTION":
+if client is not None:
     logger.add(CloudWatchSink(), level="DEBUG")
 
 def setup_logger():
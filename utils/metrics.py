@@ -0,0 +1,181 @@
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from dotenv import load_dotenv # type: ignore
+from loguru import logger # type: ignore
+
+load_dotenv()
+
+# "emf" (CloudWatch embedded metric format log lines), "prometheus" (text endpoint on METRICS_PORT) or "none"
+METRICS_EXPORT = os.getenv("METRICS_EXPORT", "emf")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "60"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "AIBackend")
+
+# Log-spaced bucket bounds from 1 ms to about 70 s, 25% apart. 51 buckets stay under EMF's 100 values per metric.
+BUCKET_BOUNDS_MS = [round(1.25 ** index, 2) for index in range(51)]
+
+NO_ACTION = "none"
+
+class MessageSpans():
+    """The action and message id spans are tagged with, plus each span of that message for its summary line."""
+
+    def __init__(self, action: str, message_id: Optional[str]):
+        self.action = action or NO_ACTION
+        self.message_id = message_id
+        self.started = time.perf_counter()
+        self.durations = []
+
+    def summary(self) -> str:
+        stages = ", ".join(f"{stage}={duration:.0f}ms" for stage, duration in self.durations)
+        return f"{stages}, total={(time.perf_counter() - self.started) * 1000:.0f}ms"
+
+# Tasks copy the context when created, so spans in tasks a handler starts keep its tags
+current_message: contextvars.ContextVar[Optional[MessageSpans]] = contextvars.ContextVar("current_message", default=None)
+
+class Histogram():
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.total = 0.0
+        self.count = 0
+        # Observed extremes; bucket bounds would cap anything past the last bucket at its bound
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, duration_ms: float):
+        index = min(len(BUCKET_BOUNDS_MS), max(0, math.ceil(math.log(max(duration_ms, 1.0), 1.25))))
+        self.counts[index] += 1
+        self.total += duration_ms
+        self.count += 1
+        self.min = min(self.min, duration_ms)
+        self.max = max(self.max, duration_ms)
+
+class SpanMetrics():
+    """Span duration histograms per (action, stage), exported as EMF lines or a Prometheus text endpoint."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms: dict[tuple, Histogram] = {}
+        self.exporter = None
+
+    def observe(self, action: str, stage: str, duration_ms: float):
+        with self.lock:
+            histogram = self.histograms.get((action, stage))
+            if histogram is None:
+                histogram = self.histograms[(action, stage)] = Histogram()
+            histogram.observe(duration_ms)
+
+    def start(self, export: str = METRICS_EXPORT):
+        """Start the exporter thread once; spans are still recorded when export is "none"."""
+        if self.exporter is not None or export == "none":
+            return
+
+        if export == "prometheus":
+            self.exporter = _serve_prometheus(self)
+        else:
+            self.exporter = threading.Thread(target=self._emit_emf_forever, name="metrics-emf", daemon=True)
+            self.exporter.start()
+
+    def _emit_emf_forever(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            self.emit_emf()
+
+    def emit_emf(self):
+        """Log one EMF line per (action, stage) seen since the last call, then start the interval over."""
+        with self.lock:
+            histograms, self.histograms = self.histograms, {}
+
+        for (action, stage), histogram in histograms.items():
+            values = []
+            counts = []
+            for index, count in enumerate(histogram.counts):
+                if count:
+                    # Past the last bound the observed max is the best value the bucket has
+                    values.append(BUCKET_BOUNDS_MS[index] if index < len(BUCKET_BOUNDS_MS) else histogram.max)
+                    counts.append(count)
+
+            emf = {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": METRICS_NAMESPACE,
+                        "Dimensions": [["Action", "Stage"]],
+                        "Metrics": [{"Name": "StageLatency", "Unit": "Milliseconds"}]
+                    }]
+                },
+                "Action": action,
+                "Stage": stage,
+                "StageLatency": {"Values": values, "Counts": counts, "Sum": histogram.total, "Count": histogram.count, "Min": histogram.min, "Max": histogram.max}
+            }
+            logger.bind(emf=True).info(json.dumps(emf))
+
+    def prometheus_text(self) -> str:
+        """Cumulative histograms in the Prometheus text exposition format."""
+        lines = [
+            "# HELP stage_latency_milliseconds Duration of one processing stage of a message",
+            "# TYPE stage_latency_milliseconds histogram"
+        ]
+
+        with self.lock:
+            for (action, stage), histogram in sorted(self.histograms.items()):
+                labels = f'action="{action}",stage="{stage}"'
+                cumulative = 0
+                for bound, count in zip(BUCKET_BOUNDS_MS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'stage_latency_milliseconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'stage_latency_milliseconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"stage_latency_milliseconds_sum{{{labels}}} {histogram.total}")
+                lines.append(f"stage_latency_milliseconds_count{{{labels}}} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+def _serve_prometheus(metrics: SpanMetrics) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", METRICS_PORT), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-prometheus", daemon=True).start()
+    logger.info(f"Serving Prometheus metrics on port {METRICS_PORT}")
+    return server
+
+span_metrics = SpanMetrics()
+
+@contextmanager
+def span(stage: str):
+    """Time a block as one stage of the current message. Works around awaits, since it only reads the clock."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        message = current_message.get()
+        span_metrics.observe(message.action if message else NO_ACTION, stage, duration_ms)
+        if message:
+            message.durations.append((stage, duration_ms))
+
+def start_message(action: str, message_id: Optional[str]) -> MessageSpans:
+    """Tag spans in the current task, and the tasks it starts, with this message."""
+    message = MessageSpans(action, message_id)
+    current_message.set(message)
+    return message
+
+async def timed(stage: str, awaitable):
+    """Await something as one span, e.g. inside asyncio.create_task or a single assignment."""
+    with span(stage):
+        return await awaitable
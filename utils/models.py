@@ -1,14 +1,133 @@
-import torch
-import open_clip
+import os
+import threading
+import time
+from contextlib import nullcontext
+from dotenv import load_dotenv # type: ignore
 from loguru import logger # type: ignore
+from utils.inference_executor import InferenceExecutor
+
+load_dotenv()
+
+CLIP_MODEL_NAME = "ViT-H-14"
+CLIP_PRETRAINED = "laion2b_s32b_b79k"
+# Local weight cache; the Docker image downloads the weights here at build time
+CLIP_CACHE_DIR = os.getenv("CLIP_CACHE_DIR") or None
+# "fp32" (default), "int8" (dynamic quantization of the linear layers, CPU only) or "bf16" (autocast).
+# Check the drift with utils/helpers/check_inference_parity.py before switching: stored vectors are fp32.
+CLIP_PRECISION = os.getenv("CLIP_PRECISION", "fp32")
+
+IMAGE_TOWER = "image"
+TEXT_TOWER = "text"
+# Modules of open_clip's CLIP that only the text tower uses
+TEXT_TOWER_MODULES = ("transformer", "token_embedding", "ln_final")
+
+def download_weights():
+    """Fetch the CLIP weights into CLIP_CACHE_DIR without keeping the model around."""
+    import open_clip
+    open_clip.create_model_and_transforms(CLIP_MODEL_NAME, pretrained=CLIP_PRETRAINED, cache_dir=CLIP_CACHE_DIR)
 
 class Models:
-    def __init__(self):
-        logger.info("Models initilization started.")
-        logger.info("starting open_clip_model and preprocess initilization.")
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.open_clip_model, self.preprocess, _ = open_clip.create_model_and_transforms("ViT-H-14", pretrained="laion2b_s32b_b79k")
-        self.open_clip_model.to(self.device)
-        logger.info("Starting tokenizer initilization.")
-        self.tokenizer = open_clip.get_tokenizer("ViT-B-32")
-        logger.info("Models initilization Completed successfully.")
+    """The open_clip model, loaded on first use with only the towers this worker needs.
+
+    Ingest workers only encode images and search workers only encode text, so the unused tower is
+    dropped right after loading instead of being kept in memory.
+    """
+
+    def __init__(self, towers: tuple = (IMAGE_TOWER, TEXT_TOWER), precision: str = CLIP_PRECISION):
+        self.towers = set(towers)
+        self.requested_precision = precision
+        self.lock = threading.Lock()
+        self._device = None
+        self._open_clip_model = None
+        self._preprocess = None
+        self._tokenizer = None
+        # Callers on the event loop run encode_image/encode_text through here
+        self.inference = InferenceExecutor()
+
+    @property
+    def device(self) -> str:
+        if self._device is None:
+            import torch
+            self._device = "cuda" if torch.cuda.is_available() else "cpu"
+        return self._device
+
+    @property
+    def precision(self) -> str:
+        """The precision inference actually runs in, known before the model loads: int8 is CPU only."""
+        if self.requested_precision == "int8" and self.device != "cpu":
+            return "fp32"
+        return self.requested_precision
+
+    @property
+    def open_clip_model(self):
+        if self._open_clip_model is None:
+            self.load()
+        return self._open_clip_model
+
+    @property
+    def preprocess(self):
+        if self._preprocess is None:
+            self.load()
+        return self._preprocess
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self.load()
+        return self._tokenizer
+
+    def load(self):
+        """Load the model once; safe to call from several threads, e.g. a warm-up task and the first request."""
+        with self.lock:
+            if self._open_clip_model is not None:
+                return
+
+            import open_clip
+
+            start = time.perf_counter()
+            logger.info(f"Models initilization started for towers {sorted(self.towers)}.")
+            open_clip_model, preprocess, _ = open_clip.create_model_and_transforms(CLIP_MODEL_NAME, pretrained=CLIP_PRETRAINED, cache_dir=CLIP_CACHE_DIR)
+
+            if IMAGE_TOWER not in self.towers:
+                open_clip_model.visual = None
+            if TEXT_TOWER not in self.towers:
+                for name in TEXT_TOWER_MODULES:
+                    setattr(open_clip_model, name, None)
+
+            open_clip_model.to(self.device)
+            open_clip_model.eval()
+
+            if self.precision != self.requested_precision:
+                logger.warning(f"CLIP_PRECISION {self.requested_precision} is CPU only, using {self.precision} on {self.device}")
+
+            if self.precision == "int8":
+                import torch
+                open_clip_model = torch.ao.quantization.quantize_dynamic(open_clip_model, {torch.nn.Linear}, dtype=torch.qint8)
+
+            logger.info("Starting tokenizer initilization.")
+            self._tokenizer = open_clip.get_tokenizer("ViT-B-32")
+            self._preprocess = preprocess
+            self._open_clip_model = open_clip_model
+            logger.info(f"Models initilization Completed successfully in {time.perf_counter() - start:.1f}s with {self.precision} precision.")
+
+    def preprocess_image(self, image):
+        """The CLIP preprocess transform, callable from a worker thread while the model is still loading."""
+        return self.preprocess(image)
+
+    def inference_context(self):
+        if self.precision != "bf16":
+            return nullcontext()
+
+        import torch
+        return torch.autocast(device_type="cuda" if self.device.startswith("cuda") else "cpu", dtype=torch.bfloat16)
+
+    def encode_image(self, images):
+        """Image embeddings as float32, whatever precision the forward pass ran in."""
+        import torch
+        with torch.no_grad(), self.inference_context():
+            return self.open_clip_model.encode_image(images).float()
+
+    def encode_text(self, tokens):
+        import torch
+        with torch.no_grad(), self.inference_context():
+            return self.open_clip_model.encode_text(tokens).float()
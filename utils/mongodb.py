@@ -1,7 +1,12 @@
 from motor.motor_asyncio import AsyncIOMotorClient  # type: ignore
+from bson import ObjectId
+from datetime import datetime
+import asyncio
 import os
 import sys
+import time
 from dotenv import load_dotenv
+from utils.bulk_writer import BulkWriter
 from utils.response import SuccessResponse  # type: ignore
 
 load_dotenv()
@@ -17,9 +22,18 @@ EXPERIENCE_PARTICIPANT_COLLECTION = os.getenv("EXPERIENCE_PARTICIPANT_COLLECTION
 ALBUM_COLLECTION =  os.getenv("ALBUM_COLLECTION")
 MEMORY_COLLECTION =  os.getenv("MEMORY_COLLECTION")
 EXPERIENCE_IMAGE_COLLECTION = os.getenv("EXPERIENCE_IMAGE_COLLECTION")
+# Materialized cluster key -> img_ids lookup, rewritten by FaceClassification on every cluster update
+FACE_CLUSTER_IMAGES_COLLECTION = os.getenv("FACE_CLUSTER_IMAGES_COLLECTION", "face_cluster_images")
+
+# img_ids per face_cluster_images query when looking up which clusters images belong to
+FACE_CLUSTER_IMAGES_QUERY_BATCH_SIZE = int(os.getenv("FACE_CLUSTER_IMAGES_QUERY_BATCH_SIZE", "1000"))
 
 INDEX_NAME = "quickstart"
 
+def cluster_images_id(user_id, cluster_key) -> str:
+    """_id of a face_cluster_images document. Prefixing with the user keeps one user's entries in a single _id index range."""
+    return f"{user_id}:{cluster_key}"
+
 class MongodbDatabase():
     def __init__(self):
 
@@ -42,4 +56,61 @@ class MongodbDatabase():
         self.experience_participant = self.database[os.getenv("EXPERIENCE_PARTICIPANT")]
         self.experience_image = self.database[os.getenv("EXPERIENCE_IMAGE_COLLECTION")]
         self.memory_collection = self.database[os.getenv("MEMORY_COLLECTION")]
+        self.face_cluster_images_collection = self.database[FACE_CLUSTER_IMAGES_COLLECTION]
+
+        self.face_embeddings_writer = BulkWriter(self.face_embeddings_collection)
+        # updated_at of the latest face_cluster_images write, as of the last completed watermark query; None until one completes
+        self.cluster_images_watermark = None
+        self.cluster_images_watermark_query = None
         # logger.info("Connected to MongoDB successfully.")
+
+    async def create_indexes(self):
+        """Indexes the face cluster lookups need; create_index is a no-op when the index already exists."""
+        await self.face_cluster_images_collection.create_index("img_ids")
+        await self.face_cluster_images_collection.create_index("updated_at")
+
+    async def fetch_cluster_images_watermark(self, started_after: float) -> datetime:
+        """updated_at of the latest face_cluster_images write, from a query started at or after started_after (time.monotonic()).
+
+        Concurrent callers share one query, so a burst of ingested images costs a single lookup.
+        datetime.min when the collection is empty.
+        """
+        query = self.cluster_images_watermark_query
+
+        if query is None or query[0] < started_after or (query[1].done() and (query[1].cancelled() or query[1].exception())):
+            query = self.cluster_images_watermark_query = (time.monotonic(), asyncio.create_task(self._query_cluster_images_watermark()))
+
+        return await asyncio.shield(query[1])
+
+    async def _query_cluster_images_watermark(self) -> datetime:
+        document = await self.face_cluster_images_collection.find_one({}, projection={"updated_at": 1}, sort=[("updated_at", -1)])
+        watermark = document["updated_at"] if document else datetime.min
+        self.cluster_images_watermark = watermark
+        return watermark
+
+    async def fetch_image_face_clusters(self, img_ids: list) -> dict:
+        """img_id -> sorted face_clusters entries of every user's clusters containing that image.
+
+        face_cluster_images is the source of truth for the face_clusters metadata of image vectors in Pinecone.
+        Every requested img_id is in the result, with an empty list when no cluster contains it.
+        """
+        face_clusters = {str(img_id): set() for img_id in img_ids}
+        object_ids = [ObjectId(img_id) for img_id in face_clusters]
+
+        for start in range(0, len(object_ids), FACE_CLUSTER_IMAGES_QUERY_BATCH_SIZE):
+            batch = object_ids[start:start + FACE_CLUSTER_IMAGES_QUERY_BATCH_SIZE]
+            documents = await self.face_cluster_images_collection.aggregate([
+                {"$match": {"img_ids": {"$in": batch}}},
+                # Only the requested ids of each cluster, not the whole list
+                {"$project": {"img_ids": {"$filter": {"input": "$img_ids", "cond": {"$in": ["$$this", batch]}}}}}
+            ]).to_list(None)
+
+            for document in documents:
+                for img_id in document["img_ids"]:
+                    face_clusters[str(img_id)].add(document["_id"])
+
+        return {img_id: sorted(entries) for img_id, entries in face_clusters.items()}
+
+    async def close(self):
+        """Flush the batching writer before shutdown."""
+        await self.face_embeddings_writer.close()
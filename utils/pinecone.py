@@ -1,6 +1,9 @@
+import asyncio
 from pinecone import Pinecone, ServerlessSpec
 import os
 from dotenv import load_dotenv
+from loguru import logger # type: ignore
+from utils.response import AppResponse, ServerErrorResponse, SuccessResponse
 
 load_dotenv()
 
@@ -8,6 +11,17 @@ pc = Pinecone(api_key=os.getenv("PINECONE_KEY"))
 
 INDEX_NAME = os.getenv("PINECONE_INDEX")
 
+# Pinecone recommends at most 100 vectors (and 2 MB) per upsert request
+PINECONE_UPSERT_BATCH_SIZE = min(100, max(1, int(os.getenv("PINECONE_UPSERT_BATCH_SIZE", "100"))))
+PINECONE_UPSERT_MAX_AGE_MS = float(os.getenv("PINECONE_UPSERT_MAX_AGE_MS", "500"))
+PINECONE_UPSERT_PARALLELISM = int(os.getenv("PINECONE_UPSERT_PARALLELISM", "4"))
+# Face cluster metadata sync: ids per fetch request, and how many fetch/update calls run at once
+PINECONE_FETCH_BATCH_SIZE = max(1, int(os.getenv("PINECONE_FETCH_BATCH_SIZE", "100")))
+PINECONE_METADATA_PARALLELISM = int(os.getenv("PINECONE_METADATA_PARALLELISM", "8"))
+
+# Image metadata field listing the "<user_id>:<cluster_key>" face clusters the image belongs to
+FACE_CLUSTERS_FIELD = "face_clusters"
+
 print("pinecone INDEX_NAME", INDEX_NAME)
 
 class PineconeDatabase():
@@ -30,3 +44,94 @@ class PineconeDatabase():
             )
 
         self.index = self.pc.Index(name=INDEX_NAME)
+
+        # Write-behind upsert buffer: (vector, future) pairs waiting for the next flush
+        self.upsert_buffer = []
+        self.upsert_flush_task = None
+        self.upsert_semaphore = asyncio.Semaphore(max(1, PINECONE_UPSERT_PARALLELISM))
+        self.upsert_batches = set()
+        self.metadata_semaphore = asyncio.Semaphore(max(1, PINECONE_METADATA_PARALLELISM))
+
+    async def upsert(self, vector: tuple) -> AppResponse:
+        """Buffer one (id, values, metadata) vector and return once the batch containing it has been written."""
+        future = asyncio.get_running_loop().create_future()
+        self.upsert_buffer.append((vector, future))
+
+        if len(self.upsert_buffer) >= PINECONE_UPSERT_BATCH_SIZE:
+            self.flush_upserts()
+        elif self.upsert_flush_task is None or self.upsert_flush_task.done():
+            self.upsert_flush_task = asyncio.create_task(self._flush_upserts_after(PINECONE_UPSERT_MAX_AGE_MS / 1000))
+
+        return await future
+
+    async def _flush_upserts_after(self, delay: float):
+        await asyncio.sleep(delay)
+        self.flush_upserts()
+
+    def flush_upserts(self):
+        """Split the buffer into batches and start uploading them in parallel."""
+        while self.upsert_buffer:
+            batch = self.upsert_buffer[:PINECONE_UPSERT_BATCH_SIZE]
+            del self.upsert_buffer[:PINECONE_UPSERT_BATCH_SIZE]
+
+            task = asyncio.create_task(self._upsert_batch(batch))
+            self.upsert_batches.add(task)
+            task.add_done_callback(self.upsert_batches.discard)
+
+    async def _upsert_batch(self, batch: list):
+        try:
+            async with self.upsert_semaphore:
+                result = await asyncio.to_thread(self.index.upsert, vectors=[vector for vector, _ in batch])
+
+            response = SuccessResponse(f"Successfully upserted {len(batch)} vectors to pinecone", result)
+        except Exception as e:
+            logger.exception(f"Exception at PineconeDatabase _upsert_batch")
+            response = ServerErrorResponse(f"Exception at PineconeDatabase _upsert_batch", e)
+
+        for _, future in batch:
+            if not future.done():
+                future.set_result(response)
+
+    async def fetch_metadata(self, ids: list) -> AppResponse:
+        """Metadata of the given vectors keyed by id, fetched in parallel batches. Unknown ids are left out."""
+        async def fetch_batch(batch: list) -> dict:
+            async with self.metadata_semaphore:
+                response = await asyncio.to_thread(self.index.fetch, ids=batch)
+            return {vector_id: vector.metadata or {} for vector_id, vector in response.vectors.items()}
+
+        try:
+            results = await asyncio.gather(*[
+                fetch_batch(ids[start:start + PINECONE_FETCH_BATCH_SIZE])
+                for start in range(0, len(ids), PINECONE_FETCH_BATCH_SIZE)
+            ])
+
+            return SuccessResponse(f"Successfully fetched metadata of {len(ids)} vectors", {vector_id: metadata for result in results for vector_id, metadata in result.items()})
+        except Exception as e:
+            logger.exception(f"Exception at PineconeDatabase fetch_metadata")
+            return ServerErrorResponse(f"Exception at PineconeDatabase fetch_metadata", e)
+
+    async def update_metadata(self, updates: dict) -> AppResponse:
+        """Set metadata fields on existing vectors, given as {id: fields}. Pinecone updates one vector per call."""
+        async def update_one(vector_id: str, fields: dict):
+            async with self.metadata_semaphore:
+                await asyncio.to_thread(self.index.update, id=vector_id, set_metadata=fields)
+
+        results = await asyncio.gather(*[update_one(vector_id, fields) for vector_id, fields in updates.items()], return_exceptions=True)
+        errors = {vector_id: result for vector_id, result in zip(updates, results) if isinstance(result, Exception)}
+
+        if errors:
+            first_error = next(iter(errors.values()))
+            logger.error(f"PineconeDatabase update_metadata failed for {len(errors)} of {len(updates)} vectors: {first_error}")
+            return ServerErrorResponse(f"Failed to update metadata of {len(errors)} vectors", first_error, list(errors))
+
+        return SuccessResponse(f"Successfully updated metadata of {len(updates)} vectors", None)
+
+    async def close(self):
+        """Flush buffered vectors and wait for every in-flight batch."""
+        self.flush_upserts()
+
+        if self.upsert_batches:
+            await asyncio.gather(*self.upsert_batches, return_exceptions=True)
+
+        if self.upsert_flush_task and not self.upsert_flush_task.done():
+            self.upsert_flush_task.cancel()
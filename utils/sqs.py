@@ -1,3 +1,4 @@
+import asyncio
 import json
 from dotenv import load_dotenv # type: ignore
 import os
@@ -12,6 +13,15 @@ AWS_SECRET_KEY = os.getenv("AWS_SECRET_KEY")
 AWS_REGION = os.getenv("AWS_REGION")
 SQS_QUEUE_URL = os.getenv("SQS_QUEUE_URL")
 
+# SQS caps both ReceiveMessage and DeleteMessageBatch at 10 entries per call
+SQS_BATCH_LIMIT = 10
+SQS_MAX_MESSAGES = min(SQS_BATCH_LIMIT, max(1, int(os.getenv("SQS_MAX_MESSAGES", "10"))))
+SQS_DELETE_BATCH_SIZE = min(SQS_BATCH_LIMIT, max(1, int(os.getenv("SQS_DELETE_BATCH_SIZE", "10"))))
+SQS_DELETE_FLUSH_INTERVAL = float(os.getenv("SQS_DELETE_FLUSH_INTERVAL", "1.0"))
+SQS_DELETE_MAX_ATTEMPTS = int(os.getenv("SQS_DELETE_MAX_ATTEMPTS", "3"))
+SQS_DELETE_BACKOFF_BASE = float(os.getenv("SQS_DELETE_BACKOFF_BASE", "0.5"))
+SQS_DELETE_BACKOFF_MAX = float(os.getenv("SQS_DELETE_BACKOFF_MAX", "5"))
+
 class SQS():
     def __init__(self):
         try:
@@ -26,46 +36,164 @@ class SQS():
         except Exception as e:
             logger.critical(f"Exception at SQS __init__", e)
 
-    async def get_sqs_messages(self)-> AppResponse:
+        # Pending deletes: dicts of message_id, receipt_handle, attempts and the caller's future
+        self.delete_buffer = []
+        self.delete_flush_task = None
+        self.delete_lock = asyncio.Lock()
+
+    async def get_sqs_messages(self, max_messages: int = SQS_MAX_MESSAGES)-> AppResponse:
         try:
             logger.info("Receiving messages from SQS...")
-            response = self.client.receive_message(
+            response = await asyncio.to_thread(
+                self.client.receive_message,
                 QueueUrl=SQS_QUEUE_URL,
-                MaxNumberOfMessages=1,
+                MaxNumberOfMessages=min(SQS_BATCH_LIMIT, max(1, max_messages)),
                 WaitTimeSeconds=5,
                 AttributeNames=['All']
             )
 
             messages = response.get('Messages', [])
-            logger.info("Received messages from SQS", messages)
-            
+            logger.info(f"Received {len(messages)} messages from SQS")
+
             if not messages:
                 logger.info("No messages in queue")
-                
+
             return SuccessResponse("No messages available", messages)
 
         except Exception as e:
             logger.critical(f"Exception at SQS get_sqs_messages", e)
             return ServerErrorResponse(f"Exception at SQS get_sqs_messages", e)
-        
-    async def delete_sqs_message(self, message_id, receipt_handle):
+
+    async def delete_sqs_message(self, message_id, receipt_handle, wait: bool = False) -> AppResponse:
+        """Queue a message for batched deletion. With wait=True, return the result of the flush that deleted it."""
         try:
-            result = self.client.delete_message(
-                QueueUrl=SQS_QUEUE_URL,
-                ReceiptHandle=receipt_handle
-            )
+            future = asyncio.get_running_loop().create_future()
+            self.delete_buffer.append({
+                "message_id": message_id,
+                "receipt_handle": receipt_handle,
+                "attempts": 0,
+                "future": future
+            })
+
+            if len(self.delete_buffer) >= SQS_DELETE_BATCH_SIZE:
+                await self.flush_deletes()
+            elif self.delete_flush_task is None or self.delete_flush_task.done():
+                self.delete_flush_task = asyncio.create_task(self._flush_deletes_after(SQS_DELETE_FLUSH_INTERVAL))
+
+            if wait:
+                return await future
 
-            if not result:
-                logger.critical(f"Failed to delete sqs message with message id: {message_id}", result)
-                return ErrorResponse(f"Failed to delete sqs message with message id: {message_id}", result)
-            
-            logger.info(f"Successfully deleted sqs message with message id: {message_id}")
-            return SuccessResponse(f"Successfully deleted sqs message with message id: {message_id}", result)
+            return SuccessResponse(f"Queued sqs message with message id: {message_id} for deletion", None)
 
         except Exception as e:
             logger.critical(f"Exception at SQS delete_sqs_message", e)
             return ServerErrorResponse(f"Exception at SQS delete_sqs_message", e)
 
+    async def _flush_deletes_after(self, delay: float):
+        await asyncio.sleep(delay)
+        await self.flush_deletes()
+
+    async def flush_deletes(self) -> AppResponse:
+        """Send everything in the delete buffer through delete_message_batch, retrying entries that failed server-side.
+
+        Retries wait for the next round, which starts after a backoff, so a throttled endpoint isn't hammered.
+        """
+        try:
+            async with self.delete_lock:
+                failed_count = 0
+                retry_round = 0
+
+                while self.delete_buffer:
+                    pending, self.delete_buffer = self.delete_buffer, []
+                    retry_entries = []
+
+                    for offset in range(0, len(pending), SQS_DELETE_BATCH_SIZE):
+                        batch_retry_entries, batch_failed_count = await self._delete_batch(pending[offset:offset + SQS_DELETE_BATCH_SIZE])
+                        retry_entries.extend(batch_retry_entries)
+                        failed_count += batch_failed_count
+
+                    if retry_entries:
+                        delay = min(SQS_DELETE_BACKOFF_MAX, SQS_DELETE_BACKOFF_BASE * (2 ** retry_round))
+                        logger.warning(f"Retrying {len(retry_entries)} sqs deletes in {delay:.1f}s")
+                        await asyncio.sleep(delay)
+                        retry_round += 1
+
+                    # Deletes queued during the backoff join this round's retries
+                    self.delete_buffer = retry_entries + self.delete_buffer
+
+                if failed_count:
+                    return ErrorResponse(f"Failed to delete {failed_count} sqs messages")
+
+                return SuccessResponse("Successfully flushed sqs deletes", None)
+
+        except Exception as e:
+            logger.critical(f"Exception at SQS flush_deletes", e)
+            return ServerErrorResponse(f"Exception at SQS flush_deletes", e)
+
+    async def _delete_batch(self, batch: list) -> tuple[list, int]:
+        """Delete one batch and resolve each entry's future. Returns the entries to retry and the permanent failure count."""
+        entries = [
+            {"Id": str(index), "ReceiptHandle": entry["receipt_handle"]}
+            for index, entry in enumerate(batch)
+        ]
+
+        try:
+            result = await asyncio.to_thread(
+                self.client.delete_message_batch,
+                QueueUrl=SQS_QUEUE_URL,
+                Entries=entries
+            )
+        except Exception as e:
+            logger.critical(f"Exception at SQS delete_message_batch", e)
+            result = {"Failed": [{"Id": entry["Id"], "SenderFault": False, "Message": str(e)} for entry in entries]}
+
+        retry_entries = []
+        failed_count = 0
+
+        for successful in result.get("Successful", []):
+            entry = batch[int(successful["Id"])]
+            logger.info(f"Successfully deleted sqs message with message id: {entry['message_id']}")
+            self._resolve(entry, SuccessResponse(f"Successfully deleted sqs message with message id: {entry['message_id']}", successful))
+
+        for failed in result.get("Failed", []):
+            entry = batch[int(failed["Id"])]
+            entry["attempts"] += 1
+
+            if not failed.get("SenderFault") and entry["attempts"] < SQS_DELETE_MAX_ATTEMPTS:
+                retry_entries.append(entry)
+                continue
+
+            failed_count += 1
+            logger.critical(f"Failed to delete sqs message with message id: {entry['message_id']}", failed)
+            self._resolve(entry, ErrorResponse(f"Failed to delete sqs message with message id: {entry['message_id']}", data=failed))
+
+        return retry_entries, failed_count
+
+    def _resolve(self, entry: dict, response: AppResponse):
+        if not entry["future"].done():
+            entry["future"].set_result(response)
+
+    async def close(self):
+        """Flush any buffered deletes before shutdown."""
+        await self.flush_deletes()
+
+        if self.delete_flush_task and not self.delete_flush_task.done():
+            self.delete_flush_task.cancel()
+
+    async def release_sqs_message(self, receipt_handle) -> AppResponse:
+        """Make a received message visible again right away, for a worker of another role to pick up."""
+        try:
+            await asyncio.to_thread(
+                self.client.change_message_visibility,
+                QueueUrl=SQS_QUEUE_URL,
+                ReceiptHandle=receipt_handle,
+                VisibilityTimeout=0
+            )
+            return SuccessResponse("Successfully released sqs message", None)
+        except Exception as e:
+            logger.exception(f"Exception at SQS release_sqs_message")
+            return ServerErrorResponse(f"Exception at SQS release_sqs_message", e)
+
     async def send_sqs_message(self, message_body: dict) -> AppResponse:
         try:
             logger.info("Sending message to SQS...")
@@ -1,3 +1,4 @@
+import asyncio
 import json
 from dotenv import load_dotenv  # type: ignore
 import os
@@ -30,7 +31,8 @@ class StepFunction:
     async def start_execution(self, payload: dict) -> AppResponse:
         try:
             logger.info("Starting a new Step Function execution...")
-            response = self.client.start_execution(
+            response = await asyncio.to_thread(
+                self.client.start_execution,
                 stateMachineArn=STEP_FUNCTION_ARN,
                 name=f"execution-{os.urandom(8).hex()}",
                 input=json.dumps(payload),
@@ -0,0 +1,124 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Awaitable, Optional
+from loguru import logger # type: ignore
+
+class WorkerPool():
+    """Bounded pool of in-flight message coroutines with an optional semaphore per action type."""
+
+    def __init__(self, max_in_flight: int = 1, action_limits: Optional[dict] = None):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        self.action_semaphores = {
+            action: asyncio.Semaphore(max(1, int(limit)))
+            for action, limit in (action_limits or {}).items()
+            if limit
+        }
+        self.tasks: set[asyncio.Task] = set()
+        # Tasks holding an in-flight slot; the others are waiting for their action's semaphore
+        self.holding: set[asyncio.Task] = set()
+        self.closing = False
+        self.slot_freed = asyncio.Event()
+
+    @property
+    def active_count(self) -> int:
+        return len(self.tasks)
+
+    @property
+    def free_slots(self) -> int:
+        """In-flight slots free, with at most max_in_flight more messages waiting for an action slot."""
+        return max(0, min(self.max_in_flight - len(self.holding), 2 * self.max_in_flight - len(self.tasks)))
+
+    async def wait_for_free_slots(self) -> int:
+        """Wait until at least one slot is free and return how many are.
+
+        Receiving only that many messages keeps received messages from waiting in memory for a slot
+        while their visibility timeout runs out.
+        """
+        while not self.free_slots:
+            self.slot_freed.clear()
+            await self.slot_freed.wait()
+
+        return self.free_slots
+
+    @asynccontextmanager
+    async def action_slot(self, action: Optional[str]):
+        """Hold the semaphore configured for this action type, if any.
+
+        The calling task gives up its in-flight slot while it waits, so a burst of one action queued
+        on its limit can't hold every slot and starve the other actions.
+        """
+        semaphore = self.action_semaphores.get(action)
+
+        if semaphore is None:
+            yield
+            return
+
+        if semaphore.locked():
+            task = asyncio.current_task()
+            self._release_slot(task)
+            await semaphore.acquire()
+
+            try:
+                await self.in_flight.acquire()
+            except BaseException:
+                semaphore.release()
+                raise
+
+            self.holding.add(task)
+        else:
+            await semaphore.acquire()
+
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def _release_slot(self, task: asyncio.Task):
+        if task in self.holding:
+            self.holding.discard(task)
+            self.in_flight.release()
+            self.slot_freed.set()
+
+    async def submit(self, coroutine: Awaitable) -> Optional[asyncio.Task]:
+        """Wait for a free slot, then schedule the coroutine. Blocks the caller while the pool is full."""
+        if self.closing:
+            coroutine.close()
+            return None
+
+        await self.in_flight.acquire()
+
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        self.holding.add(task)
+        task.add_done_callback(self._on_task_done)
+        return task
+
+    def _on_task_done(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        self._release_slot(task)
+        self.slot_freed.set()
+
+        if task.cancelled():
+            return
+
+        exception = task.exception()
+        if exception:
+            logger.opt(exception=exception).error("Unhandled exception in WorkerPool task")
+
+    async def shutdown(self, timeout: Optional[float] = None):
+        """Stop accepting work and wait for in-flight tasks; cancel whatever is left after the timeout."""
+        self.closing = True
+
+        if not self.tasks:
+            return
+
+        logger.info(f"WorkerPool draining {len(self.tasks)} in-flight tasks")
+        done, pending = await asyncio.wait(set(self.tasks), timeout=timeout)
+
+        for task in pending:
+            task.cancel()
+
+        if pending:
+            logger.warning(f"WorkerPool cancelled {len(pending)} tasks still running after {timeout}s")
+            await asyncio.gather(*pending, return_exceptions=True)